@@ -0,0 +1,43 @@
+"""Cascade and soft delete chat boxes
+
+Revision ID: 5ceced9ac740
+Revises: 748c4ec699d2
+Create Date: 2026-10-17 11:04:18.220193
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5ceced9ac740'
+down_revision: Union[str, None] = '748c4ec699d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('chatboxes', sa.Column('deleted_at', sa.TIMESTAMP(), nullable=True))
+    # Recreate the foreign key with ON DELETE CASCADE; NOT VALID skips the full-table check while
+    # holding the lock
+    op.drop_constraint('chathistory_chat_box_id_fkey', 'chathistory', type_='foreignkey')
+    op.execute(
+        'ALTER TABLE chathistory ADD CONSTRAINT chathistory_chat_box_id_fkey '
+        'FOREIGN KEY (chat_box_id) REFERENCES chatboxes (id) ON DELETE CASCADE NOT VALID'
+    )
+    # The autocommit block commits the statements above first, releasing their ACCESS EXCLUSIVE locks;
+    # VALIDATE then scans under SHARE UPDATE EXCLUSIVE, which lets reads and writes through
+    with op.get_context().autocommit_block():
+        op.execute('ALTER TABLE chathistory VALIDATE CONSTRAINT chathistory_chat_box_id_fkey')
+        op.create_index('ix_chatboxes_deleted_at', 'chatboxes', ['deleted_at'], unique=False,
+                        postgresql_where=sa.text('deleted_at IS NOT NULL'), postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_chatboxes_deleted_at', table_name='chatboxes', postgresql_concurrently=True)
+    op.drop_constraint('chathistory_chat_box_id_fkey', 'chathistory', type_='foreignkey')
+    op.create_foreign_key('chathistory_chat_box_id_fkey', 'chathistory', 'chatboxes', ['chat_box_id'], ['id'])
+    op.drop_column('chatboxes', 'deleted_at')
@@ -0,0 +1,49 @@
+"""Add chat box summary columns
+
+Revision ID: 62bcca88807d
+Revises: 5ceced9ac740
+Create Date: 2026-10-17 12:52:07.418305
+
+"""
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '62bcca88807d'
+down_revision: Union[str, None] = '5ceced9ac740'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('chatboxes', sa.Column('message_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('chatboxes', sa.Column('last_activity_at', sa.TIMESTAMP(), nullable=True))
+    op.add_column('chatboxes', sa.Column('last_message_preview', sa.String(), nullable=True))
+    # Backfill from the existing history: count, latest message and its time per box. Previews are cut
+    # to MESSAGE_PREVIEW_LENGTH, as the app does for new messages.
+    preview_length = int(os.getenv('MESSAGE_PREVIEW_LENGTH', '120'))
+    op.execute('UPDATE chatboxes SET last_activity_at = created_at')
+    op.execute(
+        'UPDATE chatboxes SET message_count = latest.message_count, last_activity_at = latest.timestamp, '
+        f'last_message_preview = left(latest.message, {preview_length}) '
+        'FROM (SELECT DISTINCT ON (chat_box_id) chat_box_id, message, timestamp, '
+        'count(*) OVER (PARTITION BY chat_box_id) AS message_count '
+        'FROM chathistory ORDER BY chat_box_id, timestamp DESC, id DESC) AS latest '
+        'WHERE chatboxes.id = latest.chat_box_id'
+    )
+    op.alter_column('chatboxes', 'last_activity_at', nullable=False, server_default=sa.text('now()'))
+    with op.get_context().autocommit_block():
+        op.create_index('ix_chatboxes_user_id_last_activity_at', 'chatboxes', ['user_id', 'last_activity_at', 'id'],
+                        unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_chatboxes_user_id_last_activity_at', table_name='chatboxes', postgresql_concurrently=True)
+    op.drop_column('chatboxes', 'last_message_preview')
+    op.drop_column('chatboxes', 'last_activity_at')
+    op.drop_column('chatboxes', 'message_count')
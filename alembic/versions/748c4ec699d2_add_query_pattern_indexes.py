@@ -0,0 +1,38 @@
+"""Add query pattern indexes
+
+Revision ID: 748c4ec699d2
+Revises: 32e4790eec55
+Create Date: 2026-10-17 09:12:41.532817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '748c4ec699d2'
+down_revision: Union[str, None] = '32e4790eec55'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index('ix_chathistory_chat_box_id_timestamp_id', 'chathistory', ['chat_box_id', 'timestamp', 'id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_chatboxes_user_id_id', 'chatboxes', ['user_id', 'id'], unique=False, postgresql_concurrently=True)
+        # Primary keys are already indexed by their constraint
+        op.drop_index('ix_chathistory_id', table_name='chathistory', postgresql_concurrently=True)
+        op.drop_index('ix_chatboxes_id', table_name='chatboxes', postgresql_concurrently=True)
+        op.drop_index('ix_users_id', table_name='users', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_users_id', 'users', ['id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_chatboxes_id', 'chatboxes', ['id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_chathistory_id', 'chathistory', ['id'], unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_chatboxes_user_id_id', table_name='chatboxes', postgresql_concurrently=True)
+        op.drop_index('ix_chathistory_chat_box_id_timestamp_id', table_name='chathistory', postgresql_concurrently=True)
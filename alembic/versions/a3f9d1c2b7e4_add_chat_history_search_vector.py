@@ -0,0 +1,37 @@
+"""Add chat history search vector
+
+Revision ID: a3f9d1c2b7e4
+Revises: 62bcca88807d
+Create Date: 2026-10-17 13:10:42.905117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f9d1c2b7e4'
+down_revision: Union[str, None] = '62bcca88807d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # A stored generated column keeps the vector in step with message on every write, so ranking
+    # reads it instead of re-parsing the text. Adding it rewrites chathistory under an exclusive
+    # lock; run during a maintenance window on large tables.
+    op.execute(
+        "ALTER TABLE chathistory ADD COLUMN search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('english', message)) STORED"
+    )
+    with op.get_context().autocommit_block():
+        op.create_index('ix_chathistory_search_vector', 'chathistory', ['search_vector'], unique=False,
+                        postgresql_using='gin', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_chathistory_search_vector', table_name='chathistory', postgresql_concurrently=True)
+    op.drop_column('chathistory', 'search_vector')
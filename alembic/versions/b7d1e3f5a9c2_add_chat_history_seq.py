@@ -0,0 +1,46 @@
+"""Add chat history seq
+
+Revision ID: b7d1e3f5a9c2
+Revises: f2a4c6e8b0d1
+Create Date: 2026-10-17 18:24:07.316592
+
+Existing messages keep a NULL seq; new ones are numbered on from the message count of their box.
+The index is built concurrently, one partition at a time, and then attached to the parent.
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d1e3f5a9c2'
+down_revision: Union[str, None] = 'f2a4c6e8b0d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+PARTITIONS = sa.text(
+    "SELECT child.relname FROM pg_inherits "
+    "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+    "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+    "WHERE parent.relname = 'chathistory' ORDER BY child.relname"
+)
+
+
+def upgrade() -> None:
+    op.add_column('chathistory', sa.Column('seq', sa.Integer(), nullable=True))
+    # An index on the parent alone stays invalid until every partition has one attached
+    op.execute('CREATE INDEX ix_chathistory_chat_box_id_seq ON ONLY chathistory (chat_box_id, seq) WHERE seq IS NOT NULL')
+    partitions = op.get_bind().execute(PARTITIONS).scalars().all()
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for partition in partitions:
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {partition}_chat_box_id_seq_idx '
+                       f'ON {partition} (chat_box_id, seq) WHERE seq IS NOT NULL')
+            op.execute(f'ALTER INDEX ix_chathistory_chat_box_id_seq ATTACH PARTITION {partition}_chat_box_id_seq_idx')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_chathistory_chat_box_id_seq', table_name='chathistory')
+    op.drop_column('chathistory', 'seq')
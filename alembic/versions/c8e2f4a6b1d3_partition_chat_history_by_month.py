@@ -0,0 +1,112 @@
+"""Partition chat history by month
+
+Revision ID: c8e2f4a6b1d3
+Revises: a3f9d1c2b7e4
+Create Date: 2026-10-17 13:42:16.508831
+
+Rebuilds chathistory as a table range-partitioned on timestamp, one partition per month from the
+oldest message through PARTITION_MONTHS_AHEAD months from now, plus a default partition. The
+rows are copied, so run it in a maintenance window sized to the table. Afterwards, partitions
+are managed with `python -m app.manage`.
+
+"""
+from datetime import date, datetime
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c8e2f4a6b1d3'
+down_revision: Union[str, None] = 'a3f9d1c2b7e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = 'id, chat_box_id, message, sender, timestamp'
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def create_indexes() -> None:
+    op.execute('ALTER TABLE chathistory ADD CONSTRAINT chathistory_chat_box_id_fkey '
+               'FOREIGN KEY (chat_box_id) REFERENCES chatboxes (id) ON DELETE CASCADE')
+    op.create_index('ix_chathistory_chat_box_id_timestamp_id', 'chathistory', ['chat_box_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_chathistory_search_vector', 'chathistory', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def upgrade() -> None:
+    op.create_table('chathistory_archives',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('chat_box_id', sa.Integer(), nullable=False),
+    sa.Column('partition_name', sa.String(), nullable=False),
+    sa.Column('path', sa.String(), nullable=False),
+    sa.Column('range_start', sa.TIMESTAMP(), nullable=False),
+    sa.Column('range_end', sa.TIMESTAMP(), nullable=False),
+    sa.Column('message_count', sa.Integer(), nullable=False),
+    sa.Column('archived_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_chathistory_archives_chat_box_id_range_start', 'chathistory_archives', ['chat_box_id', 'range_start'], unique=False)
+
+    # The id sequence outlives the old table and keeps numbering where it left off
+    op.execute('ALTER TABLE chathistory RENAME TO chathistory_unpartitioned')
+    op.execute('ALTER SEQUENCE chathistory_id_seq OWNED BY NONE')
+    op.execute(
+        "CREATE TABLE chathistory ("
+        "id INTEGER NOT NULL DEFAULT nextval('chathistory_id_seq'), "
+        "chat_box_id INTEGER NOT NULL, "
+        "message TEXT NOT NULL, "
+        "sender VARCHAR NOT NULL, "
+        "timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(), "
+        "search_vector tsvector GENERATED ALWAYS AS (to_tsvector('english', message)) STORED"
+        ") PARTITION BY RANGE (timestamp)"
+    )
+    oldest = op.get_bind().execute(sa.text('SELECT min(timestamp) FROM chathistory_unpartitioned')).scalar() or datetime.utcnow()
+    month = date(oldest.year, oldest.month, 1)
+    last = add_months(date.today().replace(day=1), int(os.getenv('PARTITION_MONTHS_AHEAD', '3')))
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE chathistory_y{month.year:04d}m{month.month:02d} PARTITION OF chathistory "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        )
+        month = add_months(month, 1)
+    op.execute('CREATE TABLE chathistory_default PARTITION OF chathistory DEFAULT')
+
+    op.execute(f'INSERT INTO chathistory ({COLUMNS}) SELECT {COLUMNS} FROM chathistory_unpartitioned')
+    op.execute('DROP TABLE chathistory_unpartitioned')
+    op.execute('ALTER SEQUENCE chathistory_id_seq OWNED BY chathistory.id')
+    # Unique constraints on a partitioned table must include the partition key
+    op.execute('ALTER TABLE chathistory ADD CONSTRAINT chathistory_pkey PRIMARY KEY (id, timestamp)')
+    create_indexes()
+    op.execute('ANALYZE chathistory')
+
+
+def downgrade() -> None:
+    # Messages already moved to archive files are not brought back
+    op.execute('ALTER TABLE chathistory RENAME TO chathistory_partitioned')
+    op.execute('ALTER TABLE chathistory_partitioned DROP CONSTRAINT chathistory_pkey')
+    op.drop_index('ix_chathistory_chat_box_id_timestamp_id', table_name='chathistory_partitioned')
+    op.drop_index('ix_chathistory_search_vector', table_name='chathistory_partitioned')
+    op.execute('ALTER SEQUENCE chathistory_id_seq OWNED BY NONE')
+    op.execute(
+        "CREATE TABLE chathistory ("
+        "id INTEGER NOT NULL DEFAULT nextval('chathistory_id_seq'), "
+        "chat_box_id INTEGER NOT NULL, "
+        "message TEXT NOT NULL, "
+        "sender VARCHAR NOT NULL, "
+        "timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT now(), "
+        "search_vector tsvector GENERATED ALWAYS AS (to_tsvector('english', message)) STORED, "
+        "CONSTRAINT chathistory_pkey PRIMARY KEY (id))"
+    )
+    op.execute(f'INSERT INTO chathistory ({COLUMNS}) SELECT {COLUMNS} FROM chathistory_partitioned')
+    op.execute('DROP TABLE chathistory_partitioned')
+    op.execute('ALTER SEQUENCE chathistory_id_seq OWNED BY chathistory.id')
+    create_indexes()
+
+    op.drop_index('ix_chathistory_archives_chat_box_id_range_start', table_name='chathistory_archives')
+    op.drop_table('chathistory_archives')
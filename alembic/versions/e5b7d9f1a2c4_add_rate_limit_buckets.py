@@ -0,0 +1,35 @@
+"""Add rate limit buckets
+
+Revision ID: e5b7d9f1a2c4
+Revises: c8e2f4a6b1d3
+Create Date: 2026-10-17 15:02:18.441207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b7d9f1a2c4'
+down_revision: Union[str, None] = 'c8e2f4a6b1d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Updated on every request when RATE_LIMIT_BACKEND=postgres; UNLOGGED skips the WAL, and a crash
+    # only empties the table, which resets every limit
+    op.create_table('rate_limit_buckets',
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('tokens', sa.Float(), nullable=False),
+    sa.Column('allowed', sa.Boolean(), nullable=False),
+    sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('key'),
+    prefixes=['UNLOGGED']
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rate_limit_buckets')
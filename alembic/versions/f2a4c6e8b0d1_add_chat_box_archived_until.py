@@ -0,0 +1,32 @@
+"""Add chat box archived_until
+
+Revision ID: f2a4c6e8b0d1
+Revises: e5b7d9f1a2c4
+Create Date: 2026-10-17 16:10:42.903114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a4c6e8b0d1'
+down_revision: Union[str, None] = 'e5b7d9f1a2c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('chatboxes', sa.Column('archived_until', sa.TIMESTAMP(), nullable=True))
+    # The registry holds one row per archived box and month, far fewer than the history rows
+    op.execute(
+        'UPDATE chatboxes SET archived_until = archived.range_end '
+        'FROM (SELECT chat_box_id, max(range_end) AS range_end FROM chathistory_archives GROUP BY chat_box_id) AS archived '
+        'WHERE chatboxes.id = archived.chat_box_id'
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('chatboxes', 'archived_until')
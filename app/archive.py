@@ -0,0 +1,152 @@
+# app/archive.py
+import asyncio
+import gzip
+import itertools
+import logging
+import os
+import re
+from collections import namedtuple
+from datetime import date, datetime, time
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+import orjson
+from sqlalchemy import delete, insert, or_, select, text, update
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+from app import models
+from app.config import ARCHIVE_DIR
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME = re.compile(r"^chathistory_y(\d{4})m(\d{2})$")
+
+# Same fields, order and attribute access as the chathistory rows returned by crud
+ArchivedMessage = namedtuple("ArchivedMessage", ["id", "chat_box_id", "message", "sender", "timestamp"])
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+def partition_name(month: date) -> str:
+    return f"chathistory_y{month.year:04d}m{month.month:02d}"
+
+def partition_range(name: str) -> Optional[Tuple[datetime, datetime]]:
+    match = PARTITION_NAME.match(name)
+    if match is None:
+        return None
+    start = date(int(match[1]), int(match[2]), 1)
+    return datetime.combine(start, time()), datetime.combine(add_months(start, 1), time())
+
+# Monthly partitions and whether they are attached; a detached one was left behind by an interrupted archive run
+async def list_partitions(conn: AsyncConnection) -> List[Tuple[str, bool]]:
+    result = await conn.execute(text(
+        "SELECT c.relname, i.inhparent IS NOT NULL FROM pg_class c "
+        "LEFT JOIN pg_inherits i ON i.inhrelid = c.oid "
+        "WHERE c.relkind = 'r' AND c.relnamespace = current_schema()::regnamespace "
+        "AND c.relname LIKE 'chathistory_y%' ORDER BY c.relname"
+    ))
+    return [(name, attached) for name, attached in result if PARTITION_NAME.match(name)]
+
+async def create_partitions(conn: AsyncConnection, first_month: date, months: int) -> List[str]:
+    created = []
+    for offset in range(months):
+        name = partition_name(add_months(first_month, offset))
+        if (await conn.execute(text("SELECT to_regclass(:name)"), {"name": name})).scalar() is not None:
+            continue
+        start, end = partition_range(name)
+        await conn.execute(text(
+            f"CREATE TABLE {name} PARTITION OF chathistory FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+        created.append(name)
+    return created
+
+# Detach the partition, write one gzipped NDJSON file per chat box, then record the files and drop the
+# table in one transaction. Safe to re-run after an interruption at any step.
+async def archive_partition(engine: AsyncEngine, name: str, archive_dir: str = ARCHIVE_DIR) -> int:
+    range_start, range_end = partition_range(name)
+    async with engine.begin() as conn:
+        if dict(await list_partitions(conn)).get(name):
+            await conn.execute(text(f"ALTER TABLE chathistory DETACH PARTITION {name}"))
+    directory = os.path.join(archive_dir, name)
+    os.makedirs(directory, exist_ok=True)
+    entries = []
+    async with engine.connect() as conn:
+        result = await conn.stream(
+            text(f"SELECT id, chat_box_id, message, sender, timestamp FROM {name} ORDER BY chat_box_id, timestamp, id")
+            .execution_options(yield_per=5000)
+        )
+        handle = None
+        async for row in result:
+            if handle is None or row.chat_box_id != entries[-1]["chat_box_id"]:
+                if handle is not None:
+                    _finish_archive_file(handle, entries[-1]["path"])
+                path = os.path.join(directory, f"{row.chat_box_id}.ndjson.gz")
+                handle = gzip.open(path + ".tmp", "wb")
+                entries.append({"chat_box_id": row.chat_box_id, "partition_name": name, "path": path,
+                                "range_start": range_start, "range_end": range_end, "message_count": 0})
+            handle.write(orjson.dumps(row._asdict()) + b"\n")
+            entries[-1]["message_count"] += 1
+        if handle is not None:
+            _finish_archive_file(handle, entries[-1]["path"])
+    async with engine.begin() as conn:
+        await conn.execute(delete(models.ChatHistoryArchive).where(models.ChatHistoryArchive.partition_name == name))
+        if entries:
+            await conn.execute(insert(models.ChatHistoryArchive), entries)
+            # History reads only look for archive files of boxes marked here
+            archived = select(models.ChatHistoryArchive.chat_box_id).where(models.ChatHistoryArchive.partition_name == name)
+            await conn.execute(
+                update(models.ChatBox)
+                .where(models.ChatBox.id.in_(archived),
+                       or_(models.ChatBox.archived_until.is_(None), models.ChatBox.archived_until < range_end))
+                .values(archived_until=range_end),
+                execution_options={"synchronize_session": False},
+            )
+        await conn.execute(text(f"DROP TABLE {name}"))
+    return sum(entry["message_count"] for entry in entries)
+
+def _finish_archive_file(handle, path: str):
+    handle.close()
+    os.replace(path + ".tmp", path)
+
+def remove_archive_files(paths: Iterable[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+ARCHIVE_READ_BATCH = 1000
+
+def _read_archive_lines(handle, count: int) -> List[bytes]:
+    return list(itertools.islice(handle, count))
+
+# Messages of one archive file, oldest first, decompressed a batch of lines at a time off the event loop
+async def iter_archive_file(path: str) -> AsyncIterator[ArchivedMessage]:
+    try:
+        handle = await asyncio.to_thread(gzip.open, path, "rb")
+    except FileNotFoundError:
+        logger.error("Archive file %s is missing", path)
+        return
+    try:
+        while True:
+            lines = await asyncio.to_thread(_read_archive_lines, handle, ARCHIVE_READ_BATCH)
+            if not lines:
+                return
+            for line in lines:
+                message = orjson.loads(line)
+                message["timestamp"] = datetime.fromisoformat(message["timestamp"])
+                yield ArchivedMessage(**message)
+    finally:
+        handle.close()
+
+# Archive files of one chat box covering months that overlap [lower, upper], oldest month first unless newest_first
+async def get_archive_paths(db: AsyncSession, chat_box_id: int, lower: Optional[datetime] = None,
+                            upper: Optional[datetime] = None, newest_first: bool = False) -> List[str]:
+    query = select(models.ChatHistoryArchive.path).where(models.ChatHistoryArchive.chat_box_id == chat_box_id)
+    if lower is not None:
+        query = query.where(models.ChatHistoryArchive.range_end > lower)
+    if upper is not None:
+        query = query.where(models.ChatHistoryArchive.range_start <= upper)
+    order = models.ChatHistoryArchive.range_start.desc() if newest_first else models.ChatHistoryArchive.range_start
+    return (await db.execute(query.order_by(order))).scalars().all()
@@ -1,37 +1,35 @@
+import hashlib
+import time
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from app import crud
-from app.database import SessionLocal
-from app.config import SECRET_KEY, ACCESS_TOKEN_EXPIRE_MINUTES
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import crud, models, schemas
+from app.cache import TTLCache
+from app.database import get_db
+from app.config import SECRET_KEY, ACCESS_TOKEN_EXPIRE_MINUTES, USER_CACHE_TTL, USER_CACHE_SIZE, TOKEN_CACHE_TTL, TOKEN_CACHE_SIZE
+from app.hashing import password_hasher
 
 # Secret key to encode JWT
 ALGORITHM = "HS256"
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 # OAuth2 password bearer instance
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# Dependency to get DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Decoded token payloads keyed by token hash, so repeated requests skip signature verification
+token_cache = TTLCache(max_size=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+# Authenticated users keyed by id, so requests skip the user lookup
+user_cache = TTLCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
 
 # Verify password
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await password_hasher.verify(plain_password, hashed_password)
 
 # Get password hash
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    return await password_hasher.hash(password)
 
 # Create access token
 def create_access_token(data: dict):
@@ -41,15 +39,36 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-# Get current user
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# Decode and verify a token, reusing the payload of a token seen before
+def decode_access_token(token: str) -> dict:
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(key)
+    if payload is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        token_exp = payload.get("exp")
+        if token_exp is not None:
+            # Never keep a payload around past the token's own expiry
+            token_cache.set(key, payload, ttl=token_exp - time.time())
+    return payload
+
+# Invalidation hooks for the user cache
+def invalidate_user(user_id: int):
+    user_cache.pop(user_id)
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_user(target.id)
+
+# Resolve the user a bearer token belongs to
+async def authenticate_token(token: str, db: AsyncSession):
     credentials_exception = HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
@@ -59,9 +78,25 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         # Check if token has expired
         if datetime.now() > datetime.fromtimestamp(token_exp):
             raise credentials_exception
-        user = crud.get_user_by_username(db, username=username)
+        user_id = payload.get("id")
+        user = user_cache.get(user_id) if user_id is not None else None
         if user is None:
+            if user_id is not None:
+                db_user = await crud.get_user(db, user_id=user_id)
+            else:
+                db_user = await crud.get_user_by_username(db, username=username)
+            if db_user is None:
+                raise credentials_exception
+            user = schemas.User.model_validate(db_user, from_attributes=True)
+            user_cache.set(user.id, user)
+        if user.username != username:
             raise credentials_exception
+        # Lets replica routing send this user's reads to the primary right after they write
+        db.info["user_id"] = user.id
         return user
     except JWTError:
         raise credentials_exception
+
+# Get current user
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    return await authenticate_token(token, db)
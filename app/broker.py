@@ -0,0 +1,169 @@
+# app/broker.py
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Iterable, Set, Tuple
+
+import asyncpg
+import orjson
+from sqlalchemy import event, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import models
+from app.config import MESSAGE_BROKER, BROKER_QUEUE_SIZE
+from app.database import ASYNC_DATABASE_URL, SessionLocal, use_primary
+
+logger = logging.getLogger(__name__)
+
+# Messages published in a transaction are held here until it commits
+PENDING_KEY = "pending_broker_messages"
+
+class InProcessBroker:
+    """Fans chat messages out to the WebSocket subscribers of this process."""
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = defaultdict(set)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    # Called before the transaction commits; subscribers only see the message once it does
+    async def publish(self, db: AsyncSession, chat_box_id: int, payload: bytes):
+        await self.publish_many(db, [(chat_box_id, payload)])
+
+    # (chat_box_id, payload) pairs from one transaction, in delivery order
+    async def publish_many(self, db: AsyncSession, messages: Iterable[Tuple[int, bytes]]):
+        db.sync_session.info.setdefault(PENDING_KEY, []).extend((self, chat_box_id, payload) for chat_box_id, payload in messages)
+
+    def deliver(self, chat_box_id: int, payload: bytes):
+        for queue in self._subscribers.get(chat_box_id, ()):
+            if queue.full():
+                # A slow consumer loses its oldest message rather than stalling everyone else
+                queue.get_nowait()
+            queue.put_nowait(payload)
+
+    @asynccontextmanager
+    async def subscribe(self, chat_box_id: int) -> AsyncIterator[asyncio.Queue]:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[chat_box_id].add(queue)
+        try:
+            yield queue
+        finally:
+            self._subscribers[chat_box_id].discard(queue)
+            if not self._subscribers[chat_box_id]:
+                del self._subscribers[chat_box_id]
+
+class PostgresBroker(InProcessBroker):
+    """Shares messages between workers with LISTEN/NOTIFY; each worker fans out to its own subscribers."""
+
+    CHANNEL = "vfarm_chat_messages"
+    # NOTIFY payloads must stay under 8000 bytes; larger messages are sent by reference
+    MAX_PAYLOAD = 7900
+    RECONNECT_DELAY = 1.0
+
+    def __init__(self, database_url: str, queue_size: int = 100):
+        super().__init__(queue_size=queue_size)
+        self.dsn = make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self._connection = None
+        self._reconnect_task = None
+        self._stopping = False
+
+    async def start(self):
+        self._stopping = False
+        await self._connect()
+
+    async def stop(self):
+        self._stopping = True
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        if self._connection is not None and not self._connection.is_closed():
+            await self._connection.close()
+        self._connection = None
+
+    async def _connect(self):
+        self._connection = await asyncpg.connect(self.dsn)
+        self._connection.add_termination_listener(self._on_terminated)
+        await self._connection.add_listener(self.CHANNEL, self._on_notification)
+
+    def _on_terminated(self, connection):
+        if not self._stopping and self._reconnect_task is None:
+            self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self):
+        try:
+            while not self._stopping:
+                try:
+                    await self._connect()
+                    logger.info("Message broker reconnected")
+                    return
+                except (OSError, asyncpg.PostgresError) as e:
+                    logger.warning("Message broker reconnect failed: %s", e)
+                    await asyncio.sleep(self.RECONNECT_DELAY)
+        finally:
+            self._reconnect_task = None
+
+    # NOTIFY is transactional, so it is only delivered if the message insert commits. A batch is
+    # sent in one statement rather than one round trip per message.
+    NOTIFY_MANY = text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload")
+
+    async def publish_many(self, db: AsyncSession, messages: Iterable[Tuple[int, bytes]]):
+        payloads = []
+        for chat_box_id, payload in messages:
+            if len(payload) > self.MAX_PAYLOAD:
+                message = orjson.loads(payload)
+                payload = orjson.dumps({"ref": message["id"], "chat_box_id": chat_box_id})
+            payloads.append(payload.decode())
+        if payloads:
+            await db.execute(self.NOTIFY_MANY, {"channel": self.CHANNEL, "payloads": payloads})
+
+    def _on_notification(self, connection, pid, channel, payload: str):
+        message = orjson.loads(payload)
+        if "ref" in message:
+            asyncio.get_running_loop().create_task(self._deliver_ref(message["chat_box_id"], message["ref"]))
+        else:
+            self.deliver(message["chat_box_id"], payload.encode())
+
+    async def _deliver_ref(self, chat_box_id: int, message_id: int):
+        async with SessionLocal() as db:
+            # The NOTIFY fires as the primary commits, before a replica is likely to have the row
+            use_primary(db)
+            result = await db.execute(
+                select(*models.ChatHistory.__table__.columns).where(models.ChatHistory.id == message_id)
+            )
+            row = result.first()
+        if row is not None:
+            self.deliver(chat_box_id, serialize_message(row))
+
+def serialize_message(row) -> bytes:
+    return orjson.dumps({
+        "id": row.id,
+        "chat_box_id": row.chat_box_id,
+        "message": row.message,
+        "sender": row.sender,
+        "timestamp": row.timestamp,
+    })
+
+@event.listens_for(Session, "after_commit")
+def _deliver_pending(session):
+    for broker, chat_box_id, payload in session.info.pop(PENDING_KEY, ()):
+        broker.deliver(chat_box_id, payload)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_pending(session):
+    session.info.pop(PENDING_KEY, None)
+
+def create_broker(backend: str) -> InProcessBroker:
+    if backend == "memory":
+        return InProcessBroker(queue_size=BROKER_QUEUE_SIZE)
+    if backend == "postgres":
+        return PostgresBroker(ASYNC_DATABASE_URL, queue_size=BROKER_QUEUE_SIZE)
+    raise ValueError(f"Unknown message broker: {backend}")
+
+message_broker = create_broker(MESSAGE_BROKER)
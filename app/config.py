@@ -8,7 +8,99 @@ load_dotenv()
 HOST = os.getenv('HOST')
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES'))
 DATABASE_URL = os.getenv('DATABASE_URL')
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL')  # Derived from DATABASE_URL when unset
 SECRET_KEY = os.getenv('SECRET_KEY')
 GOOGLE_CLIENT_ID = os.getenv('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.getenv('GOOGLE_CLIENT_SECRET')
-REDIRECT_URI = os.getenv('REDIRECT_URI')
\ No newline at end of file
+REDIRECT_URI = os.getenv('REDIRECT_URI')
+
+# Password hashing pool
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+HASH_POOL_KIND = os.getenv('HASH_POOL_KIND', 'thread')  # thread or process
+HASH_POOL_SIZE = int(os.getenv('HASH_POOL_SIZE', os.cpu_count() or 1))
+HASH_QUEUE_LIMIT = int(os.getenv('HASH_QUEUE_LIMIT', '64'))
+
+# Authentication caches (seconds / entries); set a TTL to 0 to disable a cache
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '60'))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', '300'))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '10000'))
+
+# Upper bound on messages accepted by one bulk ingestion request
+MAX_BULK_MESSAGES = int(os.getenv('MAX_BULK_MESSAGES', '10000'))
+
+# Response compression: bodies below the threshold go out as-is; Brotli is used when installed
+COMPRESSION_MINIMUM_SIZE = int(os.getenv('COMPRESSION_MINIMUM_SIZE', '1024'))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '4'))
+
+# Characters of the latest message kept on each chat box for list summaries
+MESSAGE_PREVIEW_LENGTH = int(os.getenv('MESSAGE_PREVIEW_LENGTH', '120'))
+
+# Real-time fan-out: "memory" for a single process, "postgres" (LISTEN/NOTIFY) for multiple workers
+MESSAGE_BROKER = os.getenv('MESSAGE_BROKER', 'memory')
+BROKER_QUEUE_SIZE = int(os.getenv('BROKER_QUEUE_SIZE', '100'))
+
+# Database connection pool
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '0'))  # 0 disables the timeout
+
+# Chat box deletion: soft delete hides a box at once and purges its history in bounded batches
+CHATBOX_SOFT_DELETE = os.getenv('CHATBOX_SOFT_DELETE', 'true').lower() in ('1', 'true', 'yes')
+PURGE_BATCH_SIZE = int(os.getenv('PURGE_BATCH_SIZE', '1000'))
+PURGE_BATCH_PAUSE = float(os.getenv('PURGE_BATCH_PAUSE', '0.05'))  # seconds between batches
+PURGE_INTERVAL = float(os.getenv('PURGE_INTERVAL', '30'))  # seconds between idle scans
+
+# Opt-in per-request sampling profiler, triggered by an X-Profile header (matching PROFILING_SECRET when set)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+PROFILING_SECRET = os.getenv('PROFILING_SECRET')
+PROFILING_INTERVAL = float(os.getenv('PROFILING_INTERVAL', '0.001'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/vfarm-profiles')
+
+# Monthly chathistory partitions: created ahead of time, detached and archived to ARCHIVE_DIR once old
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', '3'))
+ARCHIVE_AFTER_MONTHS = int(os.getenv('ARCHIVE_AFTER_MONTHS', '12'))
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', '/var/lib/vfarm/archive')
+
+# Production server (python -m app.server); each worker runs its own pool, broker and caches
+SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.getenv('SERVER_PORT', '8888'))
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', os.cpu_count() or 1))
+SERVER_KEEPALIVE_TIMEOUT = int(os.getenv('SERVER_KEEPALIVE_TIMEOUT', '5'))
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv('SERVER_GRACEFUL_TIMEOUT', '30'))  # seconds in-flight requests get to finish
+FORWARDED_ALLOW_IPS = os.getenv('FORWARDED_ALLOW_IPS', '127.0.0.1')
+DB_POOL_WARM = int(os.getenv('DB_POOL_WARM', DB_POOL_SIZE))  # connections opened at startup
+OAUTH_METADATA_TIMEOUT = float(os.getenv('OAUTH_METADATA_TIMEOUT', '5'))
+
+# Rate limiting: budgets are "capacity/seconds" token buckets (bursts of capacity, refilled evenly over
+# seconds), or "off". Login and signup are limited per client IP, everything else per user (IP when
+# anonymous). "memory" keeps buckets per worker; "postgres" shares them between workers.
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_TOKEN = os.getenv('RATE_LIMIT_TOKEN', '10/60')
+RATE_LIMIT_SIGNUP = os.getenv('RATE_LIMIT_SIGNUP', '5/3600')
+RATE_LIMIT_MESSAGES = os.getenv('RATE_LIMIT_MESSAGES', '120/60')
+RATE_LIMIT_SEARCH = os.getenv('RATE_LIMIT_SEARCH', '30/60')
+RATE_LIMIT_DEFAULT = os.getenv('RATE_LIMIT_DEFAULT', '600/60')
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))  # buckets kept by the memory backend
+
+# Write-behind for POST /chatboxes/{id}/messages/: "off" commits each message on its own; "commit" queues it
+# for a group commit and responds once its batch is durable; "async" responds 202 as soon as it is queued,
+# losing queued messages if the worker dies
+WRITE_BEHIND_MODE = os.getenv('WRITE_BEHIND_MODE', 'off')
+WRITE_BEHIND_MAX_BATCH = int(os.getenv('WRITE_BEHIND_MAX_BATCH', '500'))
+WRITE_BEHIND_MAX_DELAY_MS = float(os.getenv('WRITE_BEHIND_MAX_DELAY_MS', '5'))
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv('WRITE_BEHIND_QUEUE_SIZE', '10000'))
+
+# Read replicas: comma-separated URLs in the form of DATABASE_URL. Plain reads go to a healthy replica;
+# writes, locking reads and, for READ_YOUR_WRITES_WINDOW seconds after a user's last write, that
+# user's reads go to the primary. Replicas failing the health check or lagging over REPLICA_MAX_LAG
+# seconds get no reads until they recover.
+READ_REPLICA_URLS = [url.strip() for url in os.getenv('READ_REPLICA_URLS', '').split(',') if url.strip()]
+READ_YOUR_WRITES_WINDOW = float(os.getenv('READ_YOUR_WRITES_WINDOW', '5'))
+REPLICA_HEALTH_INTERVAL = float(os.getenv('REPLICA_HEALTH_INTERVAL', '5'))
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', '10'))
@@ -1,17 +1,112 @@
-from sqlalchemy.orm import Session
+import base64
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import TIMESTAMP, Integer, String, bindparam, case, delete, func, insert, literal_column, select, tuple_, update
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
 from . import models, schemas
-from passlib.context import CryptContext
+from .archive import ArchivedMessage, get_archive_paths, iter_archive_file, remove_archive_files
+from .broker import message_broker, serialize_message
+from .config import CHATBOX_SOFT_DELETE, MESSAGE_PREVIEW_LENGTH
+from .database import use_primary
+from .hashing import password_hasher
+from .search import make_snippet, search_index, tokenize
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(models.User).filter(models.User.username == username).first()
+class ChatBoxAccessError(Exception):
+    """Raised when a chat box does not exist (404) or belongs to another user (403)."""
 
-def get_user_all_chat_boxes(db: Session, user_id: int):
-    return db.query(models.ChatBox).filter(models.ChatBox.user_id == user_id).all()
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = pwd_context.hash(user.password)
+# Only called once an ownership-scoped statement matched nothing, to tell 404 from 403
+async def _chat_box_access_error(db: AsyncSession, chat_box_id: int) -> ChatBoxAccessError:
+    result = await db.execute(select(models.ChatBox.id).where(models.ChatBox.id == chat_box_id, models.ChatBox.deleted_at.is_(None)))
+    if result.first() is None:
+        return ChatBoxAccessError(404, "Chat box not found")
+    return ChatBoxAccessError(403, "Not authorized to access this chat box")
+
+def _owned_chat_box(user_id: int, chat_box_id: int):
+    return select(models.ChatBox.id).where(
+        models.ChatBox.id == chat_box_id, models.ChatBox.user_id == user_id, models.ChatBox.deleted_at.is_(None)
+    ).exists()
+
+# A user missing on a read replica may just have signed up, so misses are retried on the primary
+async def get_user(db: AsyncSession, user_id: int):
+    user = await db.get(models.User, user_id)
+    if user is None and use_primary(db):
+        user = await db.get(models.User, user_id)
+    return user
+
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    user = result.scalars().first()
+    if user is None and use_primary(db):
+        result = await db.execute(select(models.User).where(models.User.username == username))
+        user = result.scalars().first()
+    return user
+
+CHAT_BOX_COLUMNS = (models.ChatBox.id, models.ChatBox.user_id, models.ChatBox.name, models.ChatBox.created_at)
+CHAT_BOX_SUMMARY_COLUMNS = CHAT_BOX_COLUMNS + (
+    models.ChatBox.message_count, models.ChatBox.last_activity_at, models.ChatBox.last_message_preview,
+)
+
+# Plain column rows rather than ORM objects: nothing goes through the identity map, and the rows are
+# encoded straight to JSON. sort="activity" lists the most recently active boxes first.
+async def get_user_all_chat_boxes(db: AsyncSession, user_id: int, limit: Optional[int] = None, offset: int = 0,
+                                  sort: str = "created", summary: bool = False, since: Optional[datetime] = None):
+    columns = CHAT_BOX_SUMMARY_COLUMNS if summary else CHAT_BOX_COLUMNS
+    query = select(*columns).where(models.ChatBox.user_id == user_id, models.ChatBox.deleted_at.is_(None))
+    if since is not None:
+        # Approximate delta for pollers: boxes created or written to after `since`. last_activity_at is the writing
+        # transaction's start time, so a write that commits after a poll can carry an earlier time and only shows up
+        # with the box's next write; clients that need every change revalidate the full list with If-None-Match.
+        query = query.where(models.ChatBox.last_activity_at > since)
+    if sort == "activity":
+        query = query.order_by(models.ChatBox.last_activity_at.desc(), models.ChatBox.id.desc())
+    else:
+        query = query.order_by(models.ChatBox.id)
+    if limit is not None:
+        query = query.limit(limit)
+    if offset:
+        query = query.offset(offset)
+    result = await db.execute(query)
+    return result.all()
+
+# Everything that changes the box list: boxes added or deleted, and messages written to any of them
+async def get_chat_boxes_version(db: AsyncSession, user_id: int):
+    result = await db.execute(
+        select(
+            func.count(models.ChatBox.id).label("count"),
+            func.max(models.ChatBox.id).label("max_id"),
+            func.coalesce(func.sum(models.ChatBox.message_count), 0).label("message_count"),
+            func.max(models.ChatBox.last_activity_at).label("last_activity_at"),
+        ).where(models.ChatBox.user_id == user_id, models.ChatBox.deleted_at.is_(None))
+    )
+    return result.one()
+
+# History is append-only, so the message count and last activity of the box identify its current state;
+# archived_until tells history reads whether any of it lives in archive files
+async def get_chat_box_version(db: AsyncSession, chat_box_id: int, user_id: int):
+    result = await db.execute(
+        select(models.ChatBox.user_id, models.ChatBox.message_count, models.ChatBox.last_activity_at, models.ChatBox.archived_until)
+        .where(models.ChatBox.id == chat_box_id, models.ChatBox.deleted_at.is_(None))
+    )
+    chat_box = result.first()
+    if chat_box is None:
+        raise ChatBoxAccessError(404, "Chat box not found")
+    if chat_box.user_id != user_id:
+        raise ChatBoxAccessError(403, "Not authorized to access this chat box")
+    return chat_box
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    hashed_password = await password_hasher.hash(user.password)
     db_user = models.User(
         username=user.username,
         email=user.email,  # New field
@@ -19,38 +114,407 @@ def create_user(db: Session, user: schemas.UserCreate):
         password_hash=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def create_chat_box(db: Session, chat_box: schemas.ChatBoxCreate, user_id: int):
+async def create_chat_box(db: AsyncSession, chat_box: schemas.ChatBoxCreate, user_id: int):
     db_chat_box = models.ChatBox(name=chat_box.name, user_id=user_id)
     db.add(db_chat_box)
-    db.commit()
-    db.refresh(db_chat_box)
+    await db.commit()
+    await db.refresh(db_chat_box)
     return db_chat_box
 
-def create_chat_message(db: Session, chat_message: schemas.ChatMessageCreate, chat_box_id: int):
-    db_chat_message = models.ChatHistory(**chat_message.dict(), chat_box_id=chat_box_id)
-    db.add(db_chat_message)
-    db.commit()
-    db.refresh(db_chat_message)
+# What clients see of a message; seq stays internal
+CHAT_MESSAGE_COLUMNS = (
+    models.ChatHistory.id, models.ChatHistory.chat_box_id, models.ChatHistory.message, models.ChatHistory.sender, models.ChatHistory.timestamp,
+)
+
+# Fold new messages into the box summary; concurrent writers may commit out of order, so the
+# activity time and preview only move forward
+_chatboxes = models.ChatBox.__table__
+
+def _chat_box_summary_values(count, last_activity_at, preview) -> Dict:
+    newer_activity = _chatboxes.c.last_activity_at <= last_activity_at
+    return {
+        "message_count": _chatboxes.c.message_count + count,
+        "last_activity_at": case((newer_activity, last_activity_at), else_=_chatboxes.c.last_activity_at),
+        "last_message_preview": case((newer_activity, preview), else_=_chatboxes.c.last_message_preview),
+    }
+
+_chat_box_summary_update = (
+    update(_chatboxes)
+    .where(_chatboxes.c.id == bindparam("b_id", type_=Integer))
+    .values(_chat_box_summary_values(
+        bindparam("b_count", type_=Integer), bindparam("b_last_activity_at", type_=TIMESTAMP), bindparam("b_preview", type_=String),
+    ))
+)
+
+def _chat_box_summary_params(chat_box_id: int, count: int, timestamp: datetime, message: str) -> Dict:
+    return {"b_id": chat_box_id, "b_count": count, "b_last_activity_at": timestamp, "b_preview": message[:MESSAGE_PREVIEW_LENGTH]}
+
+# Messages take their seq from the box's message count while its row is locked, and the lock is held until
+# commit, so a box's messages are numbered in commit order. Counts are {chat_box_id: message_count} as locked.
+def _number_messages(counts: Dict[int, int], messages: List[Dict]) -> List[Dict]:
+    for message in messages:
+        counts[message["chat_box_id"]] += 1
+        message["seq"] = counts[message["chat_box_id"]]
+    return messages
+
+# The summary UPDATE of the owned box comes first: it checks ownership, locks the row and returns the new
+# message count, which numbers the message. now() is the transaction time on Postgres, as in the insert.
+async def create_chat_message(db: AsyncSession, chat_message: schemas.ChatMessageCreate, chat_box_id: int, user_id: int):
+    stmt = (
+        update(_chatboxes)
+        .where(_chatboxes.c.id == chat_box_id, _chatboxes.c.user_id == user_id, _chatboxes.c.deleted_at.is_(None))
+        .values(_chat_box_summary_values(1, func.now(), chat_message.message[:MESSAGE_PREVIEW_LENGTH]))
+        .returning(_chatboxes.c.message_count)
+    )
+    seq = (await db.execute(stmt)).scalar()
+    if seq is None:
+        await db.rollback()
+        raise await _chat_box_access_error(db, chat_box_id)
+    stmt = (
+        insert(models.ChatHistory)
+        .values(chat_box_id=chat_box_id, message=chat_message.message, sender=chat_message.sender, seq=seq)
+        .returning(*CHAT_MESSAGE_COLUMNS)
+    )
+    db_chat_message = (await db.execute(stmt)).first()
+    # Delivered to WebSocket subscribers once the transaction commits
+    await message_broker.publish(db, chat_box_id, serialize_message(db_chat_message))
+    await db.commit()
     return db_chat_message
 
-def get_chat_history(db: Session, chat_box_id: int):
-    return db.query(models.ChatHistory).filter(models.ChatHistory.chat_box_id == chat_box_id).order_by(models.ChatHistory.timestamp).all()
+# Validate ownership once per distinct box, locking the boxes in id order, then insert every message in one
+# transaction; SQLAlchemy batches the parameter list into multi-row INSERT ... RETURNING statements
+async def create_chat_messages_bulk(db: AsyncSession, chat_messages: List[schemas.ChatMessageBulkCreate], user_id: int):
+    chat_box_ids = {chat_message.chat_box_id for chat_message in chat_messages}
+    result = await db.execute(
+        select(models.ChatBox.id, models.ChatBox.user_id, models.ChatBox.message_count)
+        .where(models.ChatBox.id.in_(chat_box_ids), models.ChatBox.deleted_at.is_(None))
+        .order_by(models.ChatBox.id)
+        .with_for_update()
+    )
+    chat_boxes = {chat_box.id: chat_box for chat_box in result}
+    for chat_box_id in sorted(chat_box_ids):
+        if chat_box_id not in chat_boxes or chat_boxes[chat_box_id].user_id != user_id:
+            await db.rollback()
+            if chat_box_id not in chat_boxes:
+                raise ChatBoxAccessError(404, f"Chat box {chat_box_id} not found")
+            raise ChatBoxAccessError(403, f"Not authorized to access chat box {chat_box_id}")
+    counts = {chat_box_id: chat_box.message_count for chat_box_id, chat_box in chat_boxes.items()}
+    stmt = insert(models.ChatHistory).returning(*CHAT_MESSAGE_COLUMNS, sort_by_parameter_order=True)
+    result = await db.execute(stmt, _number_messages(counts, [chat_message.dict() for chat_message in chat_messages]))
+    created = result.all()
+    await _update_chat_box_summaries(db, [(row.chat_box_id, row.timestamp, row.message) for row in created])
+    # Delivered to WebSocket subscribers once the transaction commits
+    await message_broker.publish_many(db, [(row.chat_box_id, serialize_message(row)) for row in created])
+    await db.commit()
+    return created
+
+# One summary update per box; messages come in insert order, so the last one seen per box is its latest
+async def _update_chat_box_summaries(db: AsyncSession, messages: Iterable[Tuple[int, datetime, str]]):
+    summaries = {}
+    for chat_box_id, timestamp, message in messages:
+        count = summaries[chat_box_id][0] if chat_box_id in summaries else 0
+        summaries[chat_box_id] = (count + 1, timestamp, message)
+    await db.execute(_chat_box_summary_update, [
+        _chat_box_summary_params(chat_box_id, count, timestamp, message)
+        for chat_box_id, (count, timestamp, message) in sorted(summaries.items())
+    ])
+
+# Group-commit flush of app.writebehind. Entries are (chat_box_id, user_id, message) with access checked when
+# they were queued; the boxes are re-checked under FOR UPDATE, since one may have been deleted meanwhile.
+# Returns the inserted row, or the ChatBoxAccessError, for each entry. The caller commits.
+async def insert_chat_message_batch(db: AsyncSession, entries: List[Tuple[int, int, schemas.ChatMessageCreate]]):
+    result = await db.execute(
+        select(models.ChatBox.id, models.ChatBox.user_id, models.ChatBox.message_count)
+        .where(models.ChatBox.id.in_({chat_box_id for chat_box_id, _, _ in entries}), models.ChatBox.deleted_at.is_(None))
+        .order_by(models.ChatBox.id)
+        .with_for_update()
+    )
+    chat_boxes = result.all()
+    owners = {chat_box.id: chat_box.user_id for chat_box in chat_boxes}
+    outcomes = []
+    accepted = []
+    for chat_box_id, user_id, chat_message in entries:
+        if chat_box_id not in owners:
+            outcomes.append(ChatBoxAccessError(404, "Chat box not found"))
+        elif owners[chat_box_id] != user_id:
+            outcomes.append(ChatBoxAccessError(403, "Not authorized to access this chat box"))
+        else:
+            outcomes.append(None)
+            accepted.append({"chat_box_id": chat_box_id, "message": chat_message.message, "sender": chat_message.sender})
+    if not accepted:
+        return outcomes
+    counts = {chat_box.id: chat_box.message_count for chat_box in chat_boxes}
+    stmt = insert(models.ChatHistory).returning(*CHAT_MESSAGE_COLUMNS, sort_by_parameter_order=True)
+    created = iter((await db.execute(stmt, _number_messages(counts, accepted))).all())
+    for index, outcome in enumerate(outcomes):
+        if outcome is None:
+            outcomes[index] = next(created)
+    rows = [outcome for outcome in outcomes if not isinstance(outcome, ChatBoxAccessError)]
+    await _update_chat_box_summaries(db, [(row.chat_box_id, row.timestamp, row.message) for row in rows])
+    await message_broker.publish_many(db, [(row.chat_box_id, serialize_message(row)) for row in rows])
+    return outcomes
 
-def check_chatbox_ownership(db: Session, user_id: int, chat_box_id: int) -> bool:
-    chat_box = db.query(models.ChatBox).filter(models.ChatBox.id == chat_box_id, models.ChatBox.user_id == user_id).first()
-    return chat_box is not None
+# Keyset cursor over chat history: an opaque token wrapping the (timestamp, id) of a message
+def encode_history_cursor(message) -> str:
+    raw = f"{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
 
-def delete_chat_box(db: Session, chat_box_id: int):
+def decode_history_cursor(cursor: str) -> Tuple[datetime, int]:
     try:
-        db.query(models.ChatHistory).filter(models.ChatHistory.chat_box_id == chat_box_id).delete()
-        db.query(models.ChatBox).filter(models.ChatBox.id == chat_box_id).delete()
-        db.commit()
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, message_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid history cursor: {cursor}") from e
+
+# since= is a seq: the delta is every message numbered after it, in seq order
+def _chat_history_query(chat_box_id: int, user_id: int, before: Optional[str] = None, after: Optional[str] = None,
+                        since: Optional[int] = None):
+    key = tuple_(models.ChatHistory.timestamp, models.ChatHistory.id)
+    query = select(*CHAT_MESSAGE_COLUMNS).where(models.ChatHistory.chat_box_id == chat_box_id, _owned_chat_box(user_id, chat_box_id))
+    if since is not None:
+        query = query.where(models.ChatHistory.seq > since)
+    if after is not None:
+        query = query.where(key > tuple_(*decode_history_cursor(after)))
+    if before is not None:
+        query = query.where(key < tuple_(*decode_history_cursor(before)))
+    return query
+
+def _chat_history_order(since: Optional[int]):
+    if since is not None:
+        return (models.ChatHistory.seq,)
+    return (models.ChatHistory.timestamp, models.ChatHistory.id)
+
+# Messages are filtered by an ownership EXISTS in the same statement; only an empty page needs a second lookup.
+# Delta rows (since=) also carry their seq, from which the caller takes the token for the next delta.
+# archived_until comes from get_chat_box_version: archive files are only read for boxes that have some.
+# Returns column rows, not ORM objects.
+async def get_chat_history(db: AsyncSession, chat_box_id: int, user_id: int, limit: Optional[int] = None,
+                           before: Optional[str] = None, after: Optional[str] = None, since: Optional[int] = None,
+                           archived_until: Optional[datetime] = None) -> List[Row]:
+    backwards = before is not None and after is None and limit is not None and since is None
+    archived = []
+    if not backwards and _history_reaches_archive(archived_until, after=after, since=since):
+        # Archived months all precede the live partitions, so a full page of them needs no live query
+        await ensure_chatbox_access(db, user_id=user_id, chat_box_id=chat_box_id)
+        archived = await _archived_chat_history(db, chat_box_id, before=before, after=after, limit=limit)
+        if limit is not None:
+            if len(archived) == limit:
+                return archived
+            limit -= len(archived)
+    query = _chat_history_query(chat_box_id, user_id, before=before, after=after, since=since)
+    if since is not None:
+        query = query.add_columns(models.ChatHistory.seq)
+    if backwards:
+        # Paging backwards: take the newest `limit` rows before the cursor, then restore ascending order
+        query = query.order_by(models.ChatHistory.timestamp.desc(), models.ChatHistory.id.desc())
+    else:
+        query = query.order_by(*_chat_history_order(since))
+    if limit is not None:
+        query = query.limit(limit)
+    rows = (await db.execute(query)).all()
+    if not rows and not archived:
+        await ensure_chatbox_access(db, user_id=user_id, chat_box_id=chat_box_id)
+    if not backwards:
+        return archived + rows if archived else rows
+    rows = rows[::-1]
+    if len(rows) == limit or not _history_reaches_archive(archived_until):
+        # A full page of live rows; anything archived is older still
+        return rows
+    return await _archived_chat_history(db, chat_box_id, before=before, limit=limit - len(rows), newest=True) + rows
+
+# Yield messages through a server-side cursor so memory stays flat regardless of history length;
+# archived months are read line by line ahead of the live rows
+async def stream_chat_history(db: AsyncSession, chat_box_id: int, user_id: int, before: Optional[str] = None,
+                              after: Optional[str] = None, since: Optional[int] = None, batch_size: int = 500,
+                              archived_until: Optional[datetime] = None) -> AsyncIterator[Row]:
+    if _history_reaches_archive(archived_until, after=after, since=since):
+        await ensure_chatbox_access(db, user_id=user_id, chat_box_id=chat_box_id)
+        async with _aclosing(_iter_archived_chat_history(db, chat_box_id, before=before, after=after)) as messages:
+            async for message in messages:
+                yield message
+    query = _chat_history_query(chat_box_id, user_id, before=before, after=after, since=since)
+    query = query.order_by(*_chat_history_order(since))
+    result = await db.stream(query.execution_options(yield_per=batch_size))
+    async for message in result:
+        yield message
+
+# contextlib.aclosing, which needs Python 3.10: closes the archive file when a reader stops early
+@asynccontextmanager
+async def _aclosing(iterator):
+    try:
+        yield iterator
+    finally:
+        await iterator.aclose()
+
+# Every message of the box older than archived_until lives in an archive file. Deltas (since=) only read
+# live history, so a poller that has not been back since messages it missed were archived has to reread.
+def _history_reaches_archive(archived_until: Optional[datetime], after: Optional[str] = None, since: Optional[int] = None) -> bool:
+    if archived_until is None or since is not None:
+        return False
+    return after is None or decode_history_cursor(after)[0] < archived_until
+
+def _archive_window(before: Optional[str], after: Optional[str]):
+    after_key = decode_history_cursor(after) if after is not None else None
+    before_key = decode_history_cursor(before) if before is not None else None
+
+    def matches(message: ArchivedMessage) -> bool:
+        return ((after_key is None or (message.timestamp, message.id) > after_key)
+                and (before_key is None or (message.timestamp, message.id) < before_key))
+
+    return after_key[0] if after_key else None, before_key[0] if before_key else None, matches
+
+# Archived messages of the box within the requested window, oldest first. Callers must have checked ownership.
+async def _iter_archived_chat_history(db: AsyncSession, chat_box_id: int, before: Optional[str] = None,
+                                      after: Optional[str] = None) -> AsyncIterator[ArchivedMessage]:
+    lower, upper, matches = _archive_window(before, after)
+    for path in await get_archive_paths(db, chat_box_id, lower=lower, upper=upper):
+        async with _aclosing(iter_archive_file(path)) as messages:
+            async for message in messages:
+                if matches(message):
+                    yield message
+
+# Up to limit archived messages in ascending order: the oldest in the window, or the newest with newest=True.
+# Files are read one month at a time and reading stops once the page is full.
+async def _archived_chat_history(db: AsyncSession, chat_box_id: int, before: Optional[str] = None, after: Optional[str] = None,
+                                 limit: Optional[int] = None, newest: bool = False) -> List[ArchivedMessage]:
+    if not newest:
+        messages = []
+        async with _aclosing(_iter_archived_chat_history(db, chat_box_id, before=before, after=after)) as archived:
+            async for message in archived:
+                messages.append(message)
+                if len(messages) == limit:
+                    break
+        return messages
+    lower, upper, matches = _archive_window(before, after)
+    months = []
+    wanted = limit
+    for path in await get_archive_paths(db, chat_box_id, lower=lower, upper=upper, newest_first=True):
+        # Only the newest `wanted` messages of the month are kept
+        month = deque(maxlen=wanted)
+        async with _aclosing(iter_archive_file(path)) as messages:
+            async for message in messages:
+                if matches(message):
+                    month.append(message)
+        months.append(month)
+        if wanted is not None:
+            wanted -= len(month)
+            if wanted == 0:
+                break
+    return [message for month in reversed(months) for message in month]
+
+# Ranked full-text search over the messages of the user's live chat boxes, newest first among equal ranks
+async def search_chat_history(db: AsyncSession, user_id: int, query: str, limit: int = 20, offset: int = 0,
+                              chat_box_id: Optional[int] = None) -> List[Dict]:
+    owned = select(models.ChatBox.id).where(models.ChatBox.user_id == user_id, models.ChatBox.deleted_at.is_(None))
+    if chat_box_id is not None:
+        owned = owned.where(models.ChatBox.id == chat_box_id)
+    if db.bind.dialect.name == "postgresql":
+        return await _search_chat_history_postgres(db, owned, query, limit, offset)
+    return await _search_chat_history_in_memory(db, owned, query, limit, offset)
+
+# The GIN index on search_vector finds the matches; ts_headline, the costly part, only runs on the returned page
+async def _search_chat_history_postgres(db: AsyncSession, owned, query: str, limit: int, offset: int) -> List[Dict]:
+    tsquery = func.websearch_to_tsquery(models.SEARCH_CONFIG, query)
+    search_vector = literal_column("chathistory.search_vector")
+    rank = func.ts_rank_cd(search_vector, tsquery)
+    hits = (
+        select(*models.ChatHistory.__table__.columns, rank.label("rank"))
+        .where(models.ChatHistory.chat_box_id.in_(owned), search_vector.op("@@")(tsquery))
+        .order_by(rank.desc(), models.ChatHistory.id.desc())
+        .limit(limit).offset(offset)
+        .subquery()
+    )
+    stmt = select(
+        hits.c.id, hits.c.chat_box_id, hits.c.message, hits.c.sender, hits.c.timestamp, hits.c.rank,
+        func.ts_headline(models.SEARCH_CONFIG, hits.c.message, tsquery).label("snippet"),
+    ).order_by(hits.c.rank.desc(), hits.c.id.desc())
+    result = await db.execute(stmt)
+    return [dict(row) for row in result.mappings()]
+
+async def _search_chat_history_in_memory(db: AsyncSession, owned, query: str, limit: int, offset: int) -> List[Dict]:
+    await search_index.refresh(db)
+    terms = set(tokenize(query))
+    chat_box_ids = set((await db.execute(owned)).scalars())
+    page = search_index.search(terms, chat_box_ids)[offset:offset + limit]
+    if not page:
+        return []
+    result = await db.execute(select(models.ChatHistory).where(models.ChatHistory.id.in_([message_id for _, message_id in page])))
+    messages = {message.id: message for message in result.scalars()}
+    search_index.discard(message_id for _, message_id in page if message_id not in messages)
+    return [
+        {**schemas.ChatMessage.model_validate(messages[message_id], from_attributes=True).model_dump(),
+         "rank": rank, "snippet": make_snippet(messages[message_id].message, terms)}
+        for rank, message_id in page if message_id in messages
+    ]
+
+# Fetch the owner in one lookup and raise ChatBoxAccessError unless it is the given user
+async def ensure_chatbox_access(db: AsyncSession, user_id: int, chat_box_id: int):
+    result = await db.execute(select(models.ChatBox.user_id).where(models.ChatBox.id == chat_box_id, models.ChatBox.deleted_at.is_(None)))
+    owner = result.first()
+    if owner is None:
+        raise ChatBoxAccessError(404, "Chat box not found")
+    if owner.user_id != user_id:
+        raise ChatBoxAccessError(403, "Not authorized to access this chat box")
+
+# Soft delete hides the box at once and leaves its history to the purger; hard delete relies on ON DELETE CASCADE
+async def delete_chat_box(db: AsyncSession, chat_box_id: int, user_id: int, soft: bool = CHATBOX_SOFT_DELETE):
+    owned = (models.ChatBox.id == chat_box_id, models.ChatBox.user_id == user_id, models.ChatBox.deleted_at.is_(None))
+    if soft:
+        stmt = update(models.ChatBox).where(*owned).values(deleted_at=func.now())
+    else:
+        stmt = delete(models.ChatBox).where(*owned)
+    try:
+        result = await db.execute(stmt.returning(models.ChatBox.id), execution_options={"synchronize_session": False})
+        if result.first() is None:
+            await db.rollback()
+            raise await _chat_box_access_error(db, chat_box_id)
+        archive_paths = [] if soft else await _delete_chat_box_archives(db, chat_box_id)
+        await db.commit()
+        remove_archive_files(archive_paths)
         return True
-    except Exception as e:
-        db.rollback()
-        print(e)
+    except ChatBoxAccessError:
+        raise
+    except Exception:
+        await db.rollback()
+        logger.exception("Deleting chat box %s failed", chat_box_id)
         return False
+
+# Remove up to batch_size history rows of one soft-deleted box, and the box itself once it is empty.
+# Returns the number of rows removed, or None when there is nothing left to purge.
+async def purge_deleted_chat_box_batch(db: AsyncSession, batch_size: int) -> Optional[int]:
+    # SKIP LOCKED lets several workers purge different boxes side by side
+    result = await db.execute(
+        select(models.ChatBox.id).where(models.ChatBox.deleted_at.is_not(None))
+        .order_by(models.ChatBox.deleted_at).limit(1).with_for_update(skip_locked=True)
+    )
+    chat_box_id = result.scalar()
+    if chat_box_id is None:
+        await db.rollback()
+        return None
+    batch = select(models.ChatHistory.id).where(models.ChatHistory.chat_box_id == chat_box_id).limit(batch_size).scalar_subquery()
+    result = await db.execute(
+        delete(models.ChatHistory).where(models.ChatHistory.id.in_(batch)),
+        execution_options={"synchronize_session": False},
+    )
+    removed = result.rowcount
+    archive_paths = []
+    if removed < batch_size:
+        archive_paths = await _delete_chat_box_archives(db, chat_box_id)
+        await db.execute(delete(models.ChatBox).where(models.ChatBox.id == chat_box_id), execution_options={"synchronize_session": False})
+    await db.commit()
+    remove_archive_files(archive_paths)
+    return removed
+
+# Archive files are removed only once the transaction dropping their registry rows has committed
+async def _delete_chat_box_archives(db: AsyncSession, chat_box_id: int) -> List[str]:
+    result = await db.execute(
+        delete(models.ChatHistoryArchive).where(models.ChatHistoryArchive.chat_box_id == chat_box_id)
+        .returning(models.ChatHistoryArchive.path),
+        execution_options={"synchronize_session": False},
+    )
+    return result.scalars().all()
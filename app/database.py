@@ -1,13 +1,292 @@
 # app/database.py
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Text, TIMESTAMP
+import asyncio
+import itertools
+import logging
+import time
+from typing import Dict, List, Optional
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, sessionmaker
-import os
-from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import CompoundSelect, Select
+from app.cache import TTLCache
+from app.config import (
+    DATABASE_URL, ASYNC_DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    DB_POOL_PRE_PING, DB_POOL_RECYCLE, DB_STATEMENT_TIMEOUT_MS, DB_POOL_WARM,
+    READ_REPLICA_URLS, READ_YOUR_WRITES_WINDOW, REPLICA_HEALTH_INTERVAL, REPLICA_MAX_LAG, USER_CACHE_SIZE,
+)
+from app.metrics import LatencyHistogram, record_sql
 
-load_dotenv()  # Load environment variables from .env file
-DATABASE_URL = os.getenv('DATABASE_URL')
+logger = logging.getLogger(__name__)
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Async drivers used in place of the sync ones named by DATABASE_URL
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgresql+psycopg2': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+def get_async_database_url(url: str) -> str:
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername)).render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = ASYNC_DATABASE_URL or get_async_database_url(DATABASE_URL)
+
+# Pool sizing and timeouts only apply to server databases; SQLite keeps SQLAlchemy's defaults
+def engine_options(url: str) -> dict:
+    if make_url(url).get_backend_name() == 'sqlite':
+        return {}
+    options = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'pool_recycle': DB_POOL_RECYCLE,
+    }
+    if DB_STATEMENT_TIMEOUT_MS:
+        options['connect_args'] = {'server_settings': {'statement_timeout': str(DB_STATEMENT_TIMEOUT_MS)}}
+    return options
+
+# The primary's engine (and connection pool), shared by the whole application
+engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
 Base = declarative_base()
+
+class PoolStats:
+    """Connection pool counters plus the time requests spend waiting for a connection."""
+
+    def __init__(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.wait = LatencyHistogram(buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0))
+
+    def snapshot(self):
+        pool = engine.pool
+        status = {}
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            if hasattr(pool, name):
+                status[name] = getattr(pool, name)()
+        return {
+            "pool": {"class": type(pool).__name__, **status},
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "invalidations": self.invalidations,
+            "wait": self.wait.snapshot(),
+            "replicas": replica_router.snapshot(),
+        }
+
+pool_stats = PoolStats()
+
+# Pool counters and statement timing, for the primary and every replica
+def instrument_engine(target: AsyncEngine):
+    sync_engine = target.sync_engine
+
+    @event.listens_for(sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        pool_stats.connects += 1
+
+    @event.listens_for(sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        pool_stats.checkouts += 1
+
+    @event.listens_for(sync_engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        pool_stats.checkins += 1
+
+    @event.listens_for(sync_engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        pool_stats.invalidations += 1
+
+    # Time every statement so it can be attributed to the request that issued it
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        record_sql(time.perf_counter() - conn.info["query_start_time"].pop())
+
+instrument_engine(engine)
+
+# Open connections up front, all at once so each one is new, and return them to the pool
+async def warm_pool(size: int, target: AsyncEngine = engine):
+    connections = await asyncio.gather(*(target.connect() for _ in range(size)), return_exceptions=True)
+    failures = [connection for connection in connections if isinstance(connection, BaseException)]
+    for connection in connections:
+        if not isinstance(connection, BaseException):
+            await connection.close()
+    if failures:
+        raise failures[0]
+
+class Replica:
+    def __init__(self, url: str):
+        async_url = get_async_database_url(url)
+        self.name = make_url(async_url).render_as_string(hide_password=True)
+        self.engine = create_async_engine(async_url, **engine_options(async_url))
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.last_error: Optional[str] = None
+        instrument_engine(self.engine)
+        event.listen(self.engine.sync_engine, "handle_error", self._on_error)
+
+    # A dropped connection takes the replica out of rotation until the next health check passes
+    def _on_error(self, context):
+        if context.is_disconnect and self.healthy:
+            self.healthy = False
+            logger.warning("Read replica %s disconnected; reads fall back to the primary", self.name)
+
+class ReplicaRouter:
+    """Read replicas, their health, and the users whose recent writes they may not have yet."""
+
+    # Seconds behind the primary; 0 when fully replayed, since an idle primary leaves the replay timestamp behind
+    LAG_QUERY = text(
+        "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE COALESCE(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+    )
+
+    def __init__(self, urls: List[str], window: float = 5.0, interval: float = 5.0, max_lag: float = 10.0):
+        self.replicas = [Replica(url) for url in urls]
+        self.interval = interval
+        self.max_lag = max_lag
+        self.recent_writers = TTLCache(max_size=USER_CACHE_SIZE, ttl=window)
+        self._next = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if not self.replicas:
+            return
+        await self.check_all()
+        for replica in self.replicas:
+            if replica.healthy:
+                try:
+                    await warm_pool(DB_POOL_WARM, replica.engine)
+                except Exception as exc:
+                    logger.warning("Could not warm the pool of read replica %s: %r", replica.name, exc)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check_all()
+
+    async def check_all(self):
+        await asyncio.gather(*(self.check(replica) for replica in self.replicas))
+
+    async def _measure_lag(self, replica: Replica) -> float:
+        async with replica.engine.connect() as conn:
+            if conn.dialect.name == "postgresql":
+                return float((await conn.execute(self.LAG_QUERY)).scalar())
+            await conn.execute(text("SELECT 1"))
+            return 0.0
+
+    async def check(self, replica: Replica):
+        try:
+            # Bounds the connect as well as the query, so an unreachable replica cannot stall startup
+            lag = await asyncio.wait_for(self._measure_lag(replica), self.interval)
+        except Exception as exc:
+            replica.lag = None
+            replica.last_error = repr(exc)
+            healthy = False
+        else:
+            replica.lag = lag
+            replica.last_error = None
+            healthy = lag <= self.max_lag
+        if healthy != replica.healthy:
+            if healthy:
+                logger.info("Read replica %s is healthy", replica.name)
+            else:
+                logger.warning("Read replica %s taken out of rotation (lag %s, error %s)", replica.name, replica.lag, replica.last_error)
+        replica.healthy = healthy
+
+    # Round robin over the healthy replicas; None sends the read to the primary
+    def choose(self) -> Optional[Replica]:
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)]
+
+    def record_write(self, user_id: int):
+        if self.replicas:
+            self.recent_writers.set(user_id, True)
+
+    def wrote_recently(self, user_id: Optional[int]) -> bool:
+        return user_id is not None and self.recent_writers.get(user_id) is not None
+
+    def snapshot(self):
+        return [
+            {"name": replica.name, "healthy": replica.healthy, "lag": replica.lag, "error": replica.last_error,
+             "pool": replica.engine.pool.status()}
+            for replica in self.replicas
+        ]
+
+replica_router = ReplicaRouter(READ_REPLICA_URLS, window=READ_YOUR_WRITES_WINDOW, interval=REPLICA_HEALTH_INTERVAL,
+                               max_lag=REPLICA_MAX_LAG)
+
+def _is_plain_read(clause) -> bool:
+    return isinstance(clause, (Select, CompoundSelect)) and clause._for_update_arg is None
+
+class RoutingSession(Session):
+    """Sends plain SELECTs to a read replica, and everything else to the primary.
+
+    Once a session writes, flushes or locks rows it stays on the primary, so it reads what it wrote;
+    so does every session of a user who wrote within READ_YOUR_WRITES_WINDOW (db.info["user_id"] is
+    set by authentication). A session keeps the replica it picked first while that stays healthy.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if not self.info.get("primary"):
+            if self._flushing or (clause is not None and not _is_plain_read(clause)):
+                self.info["primary"] = True
+            elif not replica_router.wrote_recently(self.info.get("user_id")):
+                replica = self.info.get("replica")
+                if replica is None or not replica.healthy:
+                    replica = replica_router.choose()
+                    self.info["replica"] = replica
+                if replica is not None:
+                    return replica.engine.sync_engine
+        return engine.sync_engine
+
+@event.listens_for(RoutingSession, "after_commit")
+def _remember_writer(session):
+    if session.info.get("primary") and session.info.get("user_id") is not None:
+        replica_router.record_write(session.info["user_id"])
+
+# Sends the rest of the session to the primary; False when there are no replicas or it already was
+def use_primary(db: AsyncSession) -> bool:
+    if not replica_router.replicas or db.info.get("primary"):
+        return False
+    db.info["primary"] = True
+    return True
+
+# The user and node a session reads as, for a second session that must not see less than the first did
+def routing_info(db: AsyncSession) -> Dict:
+    return {key: db.info[key] for key in ("user_id", "primary", "replica") if key in db.info}
+
+SessionLocal = async_sessionmaker(
+    engine, class_=AsyncSession, autoflush=False, expire_on_commit=False,
+    sync_session_class=RoutingSession if replica_router.replicas else Session,
+)
+
+# Dependency to get DB session. Without replicas the connection is checked out up front so pool waits
+# are measured; with them, the first statement decides whether a replica or the primary serves it.
+async def get_db():
+    async with SessionLocal() as db:
+        if not replica_router.replicas:
+            start = time.perf_counter()
+            await db.connection()
+            pool_stats.wait.observe(time.perf_counter() - start)
+        yield db
@@ -0,0 +1,92 @@
+# app/hashing.py
+import asyncio
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
+from passlib.context import CryptContext
+from app.config import BCRYPT_ROUNDS, HASH_POOL_KIND, HASH_POOL_SIZE, HASH_QUEUE_LIMIT
+from app.metrics import LatencyHistogram, record_bcrypt
+
+# Password hashing context
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+class HashingPoolSaturated(Exception):
+    """Raised when the hashing pool and its queue are full."""
+
+# Module-level so they can be pickled into a process pool; return the time spent hashing
+def _timed_hash(password: str) -> Tuple[str, float]:
+    start = time.perf_counter()
+    return pwd_context.hash(password), time.perf_counter() - start
+
+def _timed_verify(plain_password: str, hashed_password: str) -> Tuple[bool, float]:
+    start = time.perf_counter()
+    return pwd_context.verify(plain_password, hashed_password), time.perf_counter() - start
+
+class PasswordHasher:
+    """Runs bcrypt off the event loop on a bounded thread or process pool."""
+
+    def __init__(self, kind: str = "thread", size: int = 1, queue_limit: int = 0):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown hashing pool kind: {kind}")
+        self.kind = kind
+        self.size = size
+        self.queue_limit = queue_limit
+        self.in_flight = 0
+        self.rejected = 0
+        self.latency = {"hash": LatencyHistogram(), "verify": LatencyHistogram()}
+        self.compute = {"hash": LatencyHistogram(), "verify": LatencyHistogram()}
+        self._executor: Optional[Executor] = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.size)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="bcrypt")
+        return self._executor
+
+    async def _run(self, operation: str, func: Callable, *args):
+        # Back-pressure: refuse work instead of letting the queue grow without bound
+        if self.in_flight >= self.size + self.queue_limit:
+            self.rejected += 1
+            raise HashingPoolSaturated()
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            result, compute_time = await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.in_flight -= 1
+        elapsed = time.perf_counter() - start
+        self.latency[operation].observe(elapsed)
+        record_bcrypt(elapsed)
+        self.compute[operation].observe(compute_time)
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", _timed_hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run("verify", _timed_verify, plain_password, hashed_password)
+
+    def snapshot(self):
+        return {
+            "pool": {
+                "kind": self.kind,
+                "size": self.size,
+                "queue_limit": self.queue_limit,
+                "in_flight": self.in_flight,
+                "rejected": self.rejected,
+                "bcrypt_rounds": BCRYPT_ROUNDS,
+            },
+            # Latency includes queueing; compute is the time spent inside bcrypt
+            "latency": {operation: histogram.snapshot() for operation, histogram in self.latency.items()},
+            "compute": {operation: histogram.snapshot() for operation, histogram in self.compute.items()},
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+password_hasher = PasswordHasher(kind=HASH_POOL_KIND, size=HASH_POOL_SIZE, queue_limit=HASH_QUEUE_LIMIT)
@@ -1,42 +1,76 @@
 # app/main.py
-from typing import List
-from fastapi import FastAPI, Depends, HTTPException, Response, status, Request
-from sqlalchemy.orm import Session
-from app import models, schemas, crud
-from app.database import SessionLocal, engine
-from app.auth import verify_password, create_access_token, get_current_user, ACCESS_TOKEN_EXPIRE_MINUTES
+from typing import Dict, List, Literal, Optional, Union
+import asyncio
+from datetime import datetime
+from fastapi import FastAPI, Depends, HTTPException, Query, Response, status, Request, WebSocket, WebSocketDisconnect
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import schemas, crud
+from app.database import SessionLocal, engine, get_db, pool_stats, replica_router, routing_info, warm_pool
+from app.auth import verify_password, create_access_token, authenticate_token, get_current_user, token_cache, user_cache, ACCESS_TOKEN_EXPIRE_MINUTES
+from app.broker import message_broker
+from app.hashing import HashingPoolSaturated, password_hasher
+from app.purger import chat_box_purger
+from app.metrics import MetricsMiddleware, TimedJSONResponse, TimedORJSONResponse, metrics_registry, render_counter, render_gauges, render_histograms
+from app.middleware import CompressionMiddleware, PathScopedMiddleware
+from app.oauth import get_google_client, preload_google_client
+from app.ratelimit import RateLimitMiddleware, rate_limiter
+from app.writebehind import WriteBehindSaturated, write_behind
+from app.profiling import RequestProfiler
+from app.conditional import as_naive_utc, is_not_modified, make_etag, not_modified_response, validator_headers
 import logging
+import orjson
+from pydantic import TypeAdapter, ValidationError
 from contextlib import asynccontextmanager
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.responses import JSONResponse
-from fastapi_sqlalchemy import DBSessionMiddleware
-from authlib.integrations.starlette_client import OAuth, OAuthError
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from starlette.middleware.sessions import SessionMiddleware
-from app.config import SECRET_KEY, DATABASE_URL, GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, REDIRECT_URI, HOST
+from app.config import SECRET_KEY, HOST, MAX_BULK_MESSAGES
+from app.config import PROFILING_ENABLED, PROFILING_SECRET, PROFILING_INTERVAL, PROFILE_DIR
+from app.config import COMPRESSION_MINIMUM_SIZE, GZIP_LEVEL, BROTLI_QUALITY
+from app.config import DB_POOL_WARM, RATE_LIMIT_ENABLED
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.responses import RedirectResponse
 
-models.Base.metadata.create_all(bind=engine)
-
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup event
+    # Startup event; the schema is managed by Alembic (alembic upgrade head), not created here
+    # Warm up so the first requests don't pay for connection setup; OAuth loads in the background
+    await warm_pool(DB_POOL_WARM)
+    await replica_router.start()
+    oauth_preload = asyncio.create_task(preload_google_client())
+    await message_broker.start()
+    await chat_box_purger.start()
+    await rate_limiter.start()
+    if write_behind is not None:
+        await write_behind.start()
     logger.info("Application Vfarm startup complete.")
     yield
-    # Shutdown event
+    # Shutdown event; queued messages are flushed while the broker and engine are still up
+    if write_behind is not None:
+        await write_behind.stop()
+    oauth_preload.cancel()
+    await rate_limiter.stop()
+    await chat_box_purger.stop()
+    await message_broker.stop()
+    password_hasher.shutdown()
+    await replica_router.stop()
+    await engine.dispose()
     logger.info("Application Vfarm shutdown.")
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=TimedJSONResponse)
 origins = [
     "http://localhost",
     "http://localhost:8888",
 ]
+# Inside CORS, so preflights are never counted and 429s still carry CORS headers
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -45,35 +79,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Middleware to manage database sessions
-app.add_middleware(DBSessionMiddleware, db_url=DATABASE_URL)
-# Configure SessionMiddleware
-app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY)
-
-# Configure OAuth for Google
-oauth = OAuth()
-oauth.register(
-    name='google',
-    server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
-    client_id=GOOGLE_CLIENT_ID,
-    client_secret=GOOGLE_CLIENT_SECRET,
-    authorize_params=None,
-    access_token_params=None,
-    redirect_uri=REDIRECT_URI,
-    client_kwargs={
-        'scope': 'email profile openid',
-        'redirect_url': REDIRECT_URI
-    },
-    authorize_state=SECRET_KEY
-)
-
-# Dependency to get the DB session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Only the OAuth flow and its helpers use request.session; API calls skip signing and parsing the cookie
+SESSION_PATHS = ("/auth/google", "/logout", "/debug")
+app.add_middleware(PathScopedMiddleware, scoped_middleware=SessionMiddleware, prefixes=SESSION_PATHS, secret_key=SECRET_KEY)
+app.add_middleware(CompressionMiddleware, minimum_size=COMPRESSION_MINIMUM_SIZE, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY)
+# Outermost, so the recorded latency covers the whole middleware stack
+profiler = RequestProfiler(PROFILE_DIR, interval=PROFILING_INTERVAL, secret=PROFILING_SECRET) if PROFILING_ENABLED else None
+app.add_middleware(MetricsMiddleware, profiler=profiler)
 
 # Exception handlers
 @app.exception_handler(HTTPException)
@@ -83,6 +95,29 @@ async def http_exception_handler(request, exc):
         content={"message": exc.detail},
     )
 
+@app.exception_handler(crud.ChatBoxAccessError)
+async def chat_box_access_error_handler(request, exc):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"message": exc.detail},
+    )
+
+@app.exception_handler(HashingPoolSaturated)
+async def hashing_saturated_handler(request, exc):
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"message": "Too many concurrent authentication requests, retry later"},
+        headers={"Retry-After": "1"},
+    )
+
+@app.exception_handler(WriteBehindSaturated)
+async def write_behind_saturated_handler(request, exc):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"message": "Too many messages queued, retry later"},
+        headers={"Retry-After": "1"},
+    )
+
 @app.exception_handler(Exception)
 async def generic_exception_handler(request, exc):
     return JSONResponse(
@@ -93,18 +128,66 @@ async def generic_exception_handler(request, exc):
 @app.get("/debug")
 async def debug_session(request: Request):
     session = request.session
-    print(session)  # Print session content for debugging
+    logger.info("Session: %s", session)
     return {"message": "Session debug information printed"}
 
 @app.get("/")
 def read_root():
     return {"Hello": "World"}
 
+# Prometheus scrape endpoint
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    pool = pool_stats.snapshot()
+    lines = [metrics_registry.render().rstrip("\n")]
+    lines += render_gauges("vfarm_db_pool_connections", "Connection pool state.", "state",
+                           {key: value for key, value in pool["pool"].items() if key != "class"})
+    lines += render_gauges("vfarm_db_replica_healthy", "Whether a read replica receives reads.", "replica",
+                           {replica["name"]: int(replica["healthy"]) for replica in pool["replicas"]})
+    lines += render_gauges("vfarm_db_replica_lag_seconds", "Replication lag at the last health check.", "replica",
+                           {replica["name"]: replica["lag"] for replica in pool["replicas"] if replica["lag"] is not None})
+    lines += render_histograms("vfarm_db_pool_wait_seconds", "Time spent waiting for a pooled connection.", (), {(): pool_stats.wait})
+    lines += render_histograms("vfarm_bcrypt_call_duration_seconds", "bcrypt call latency including queueing.",
+                               ("operation",), {(operation,): histogram for operation, histogram in password_hasher.latency.items()})
+    lines += render_histograms("vfarm_bcrypt_compute_seconds", "Time spent inside bcrypt.",
+                               ("operation",), {(operation,): histogram for operation, histogram in password_hasher.compute.items()})
+    lines += render_gauges("vfarm_bcrypt_pool", "Hashing pool state.", "state",
+                           {"in_flight": password_hasher.in_flight, "rejected": password_hasher.rejected})
+    lines += render_counter("vfarm_auth_cache_hits_total", "Authentication cache hits.", ("cache",),
+                            {("tokens",): token_cache.hits, ("users",): user_cache.hits})
+    lines += render_counter("vfarm_auth_cache_misses_total", "Authentication cache misses.", ("cache",),
+                            {("tokens",): token_cache.misses, ("users",): user_cache.misses})
+    lines += render_counter("vfarm_rate_limited_total", "Requests rejected with 429.", ("rule",),
+                            {(rule,): count for rule, count in rate_limiter.rejected.items()})
+    lines += render_counter("vfarm_rate_limit_store_errors_total", "Rate limit checks allowed because the store failed.", (),
+                            {(): rate_limiter.errors})
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/hashing")
+async def hashing_metrics():
+    return password_hasher.snapshot()
+
+@app.get("/metrics/pool")
+async def pool_metrics():
+    return pool_stats.snapshot()
+
+@app.get("/metrics/auth-cache")
+async def auth_cache_metrics():
+    return {"tokens": token_cache.snapshot(), "users": user_cache.snapshot()}
+
+@app.get("/metrics/write-behind")
+async def write_behind_metrics():
+    return write_behind.snapshot() if write_behind is not None else {"mode": "off"}
+
+@app.get("/metrics/rate-limit")
+async def rate_limit_metrics():
+    return rate_limiter.snapshot()
+
 
 @app.post("/token")
-async def login_for_access_token(form_data: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = crud.get_user_by_username(db, form_data.username)
-    if not user or not verify_password(form_data.password, user.password_hash):
+async def login_for_access_token(form_data: schemas.UserLogin, db: AsyncSession = Depends(get_db)):
+    user = await crud.get_user_by_username(db, form_data.username)
+    if not user or not await verify_password(form_data.password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -123,60 +206,234 @@ async def login_for_access_token(form_data: schemas.UserLogin, db: Session = Dep
     return response
 
 @app.post("/users/", response_model=schemas.UserCreate)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_username(db, username=user.username)
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await crud.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return crud.create_user(db=db, user=user)
+    return await crud.create_user(db=db, user=user)
 
-@app.get("/chatboxes/", response_model=List[schemas.ChatBox])
-def get_chatboxes_by_user(db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    return crud.get_user_all_chat_boxes(db=db, user_id=current_user.id)
+# summary=true adds message count, last activity and a preview of the latest message, read from the box row itself.
+# List endpoints encode column rows directly with orjson; response_model only documents the shape.
+# Conditional GETs are answered from one aggregate over the box rows; since= returns only boxes active after it,
+# approximately: a write committing after a poll may carry an earlier time (see crud.get_user_all_chat_boxes).
+@app.get("/chatboxes/", response_model=List[Union[schemas.ChatBoxSummary, schemas.ChatBox]])
+async def get_chatboxes_by_user(
+    request: Request,
+    summary: bool = False,
+    sort: Literal["created", "activity"] = "created",
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    since: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user),
+):
+    version = await crud.get_chat_boxes_version(db, user_id=current_user.id)
+    etag = make_etag("chatboxes", current_user.id, *version, request.url.query)
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    chat_boxes = await crud.get_user_all_chat_boxes(db=db, user_id=current_user.id, limit=limit, offset=offset, sort=sort,
+                                                    summary=summary, since=as_naive_utc(since))
+    return TimedORJSONResponse([chat_box._asdict() for chat_box in chat_boxes], headers=validator_headers(etag))
 
 @app.post("/chatboxes/", response_model=schemas.ChatBox)
-def create_chat_box(chat_box: schemas.ChatBoxCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    return crud.create_chat_box(db=db, chat_box=chat_box, user_id=current_user.id)
+async def create_chat_box(chat_box: schemas.ChatBoxCreate, db: AsyncSession = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+    return await crud.create_chat_box(db=db, chat_box=chat_box, user_id=current_user.id)
+
+# With WRITE_BEHIND_MODE set, the message joins the next group commit: "commit" responds with the stored
+# message once its batch commits, "async" responds 202 as soon as it is queued
+@app.post("/chatboxes/{chat_box_id}/messages/", response_model=schemas.ChatMessage,
+          responses={202: {"description": "Queued for the next group commit (WRITE_BEHIND_MODE=async)"}})
+async def create_chat_message(chat_box_id: int, chat_message: schemas.ChatMessageCreate, db: AsyncSession = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+    if write_behind is None:
+        return await crud.create_chat_message(db=db, chat_message=chat_message, chat_box_id=chat_box_id, user_id=current_user.id)
+    await crud.ensure_chatbox_access(db, current_user.id, chat_box_id)
+    # Hand the connection back to the pool rather than holding it while the batch fills
+    await db.close()
+    future = write_behind.submit(chat_box_id, current_user.id, chat_message)
+    if future is None:
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={"status": "queued"})
+    return await future
 
-@app.post("/chatboxes/{chat_box_id}/messages/", response_model=schemas.ChatMessage)
-def create_chat_message(chat_box_id: int, chat_message: schemas.ChatMessageCreate, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    if not crud.check_chatbox_ownership(db, user_id=current_user.id, chat_box_id=chat_box_id):
-        raise HTTPException(status_code=403, detail="Not authorized to access this chat box")
-    return crud.create_chat_message(db=db, chat_message=chat_message, chat_box_id=chat_box_id)
+bulk_messages_adapter = TypeAdapter(List[schemas.ChatMessageBulkCreate])
+bulk_message_schema = schemas.ChatMessageBulkCreate.model_json_schema()
+
+@app.post(
+    "/chatboxes/messages/bulk/",
+    response_model=List[schemas.ChatMessageBulkResult],
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "application/json": {"schema": {"type": "array", "items": bulk_message_schema}},
+        "application/x-ndjson": {"schema": bulk_message_schema},
+    }}},
+)
+async def create_chat_messages_bulk(request: Request, db: AsyncSession = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+    # Accepts a JSON array, or one message per line when sent as application/x-ndjson
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            payload = [orjson.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            payload = orjson.loads(body)
+        chat_messages = bulk_messages_adapter.validate_python(payload)
+    except (orjson.JSONDecodeError, ValidationError) as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    if not chat_messages:
+        return []
+    if len(chat_messages) > MAX_BULK_MESSAGES:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"At most {MAX_BULK_MESSAGES} messages per request")
+    return await crud.create_chat_messages_bulk(db=db, chat_messages=chat_messages, user_id=current_user.id)
 
 @app.delete("/chatboxes/{chat_box_id}/", response_model=schemas.ChatBoxDeleteResponse)
-def delete_chat_box(chat_box_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    if not crud.check_chatbox_ownership(db, user_id=current_user.id, chat_box_id=chat_box_id):
-        raise HTTPException(status_code=403, detail="Not authorized to access this chat box")
-    return JSONResponse(content={"result": crud.delete_chat_box(db, chat_box_id)})
+async def delete_chat_box(chat_box_id: int, db: AsyncSession = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
+    result = await crud.delete_chat_box(db, chat_box_id, user_id=current_user.id)
+    chat_box_purger.wake()
+    return JSONResponse(content={"result": result})
+
+# Stream chat history as NDJSON from its own session, since the request session is closed before the body is sent.
+# It reads as the request session did (routing_info), so it is never behind the X-Message-Seq sent with it.
+async def stream_chat_history_ndjson(chat_box_id: int, user_id: int, before: Optional[str], after: Optional[str], since: Optional[int],
+                                     archived_until: Optional[datetime], routing: Dict):
+    async with SessionLocal() as db:
+        db.info.update(routing)
+        async for message in crud.stream_chat_history(db, chat_box_id=chat_box_id, user_id=user_id, before=before, after=after, since=since,
+                                                      archived_until=archived_until):
+            yield orjson.dumps(message._asdict()) + b"\n"
 
+# ETag and Last-Modified come from the box's message count and last activity, so a 304 is answered
+# from one primary-key lookup without reading history. X-Message-Seq is the token for since=, which then
+# returns every message written after that response, in write order: one may come twice, but none is skipped
+# while it is still in live history.
 @app.get("/chatboxes/{chat_box_id}/messages/", response_model=List[schemas.ChatMessage])
-def get_chat_history(chat_box_id: int, db: Session = Depends(get_db), current_user: schemas.User = Depends(get_current_user)):
-    if not crud.check_chatbox_ownership(db, user_id=current_user.id, chat_box_id=chat_box_id):
-        raise HTTPException(status_code=403, detail="Not authorized to access this chat box")
-    return crud.get_chat_history(db=db, chat_box_id=chat_box_id)
+async def get_chat_history(
+    chat_box_id: int,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    since: Optional[int] = Query(None, ge=0),
+    stream: bool = False,
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user),
+):
+    try:
+        for cursor in (before, after):
+            if cursor is not None:
+                crud.decode_history_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if since is not None and (before is not None or after is not None):
+        raise HTTPException(status_code=400, detail="since cannot be combined with before or after")
+    if stream and limit is not None:
+        raise HTTPException(status_code=400, detail="stream cannot be combined with limit")
+    # Also checks access up front, so errors are reported before a streamed body starts
+    chat_box = await crud.get_chat_box_version(db, chat_box_id=chat_box_id, user_id=current_user.id)
+    if stream:
+        return StreamingResponse(stream_chat_history_ndjson(chat_box_id, current_user.id, before, after, since, chat_box.archived_until,
+                                                            routing_info(db)),
+                                 media_type="application/x-ndjson", headers={"X-Message-Seq": str(chat_box.message_count)})
+    etag = make_etag("history", chat_box_id, chat_box.message_count, chat_box.last_activity_at, request.url.query)
+    if is_not_modified(request, etag, chat_box.last_activity_at):
+        return not_modified_response(etag, chat_box.last_activity_at)
+    messages = await crud.get_chat_history(db=db, chat_box_id=chat_box_id, user_id=current_user.id, limit=limit,
+                                           before=before, after=after, since=since, archived_until=chat_box.archived_until)
+    body = [message._asdict() for message in messages]
+    if since is None:
+        seq = chat_box.message_count
+    else:
+        # Messages from before seqs existed have none, so seqs need not start at 1: the token is the last one returned
+        seq = messages[-1].seq if messages else since
+        for message in body:
+            del message["seq"]
+    response = TimedORJSONResponse(body, headers=validator_headers(etag, chat_box.last_activity_at))
+    response.headers["X-Message-Seq"] = str(seq)
+    if limit is not None and messages:
+        # Cursors for the neighbouring pages: pass X-Prev-Cursor as `before`, X-Next-Cursor as `after`
+        response.headers["X-Prev-Cursor"] = crud.encode_history_cursor(messages[0])
+        response.headers["X-Next-Cursor"] = crud.encode_history_cursor(messages[-1])
+    return response
+
+# Ranked full-text search over the caller's chat boxes, optionally narrowed to one box;
+# q accepts web-search syntax on Postgres ("quoted phrases", or, -excluded)
+@app.get("/search/", response_model=List[schemas.ChatMessageSearchHit])
+async def search_chat_history(
+    q: str = Query(..., min_length=1, max_length=256),
+    chat_box_id: Optional[int] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=10000),
+    db: AsyncSession = Depends(get_db),
+    current_user: schemas.User = Depends(get_current_user),
+):
+    if chat_box_id is not None:
+        await crud.ensure_chatbox_access(db, user_id=current_user.id, chat_box_id=chat_box_id)
+    return TimedORJSONResponse(await crud.search_chat_history(db, user_id=current_user.id, query=q, limit=limit, offset=offset, chat_box_id=chat_box_id))
+
+# Same credentials as the HTTP API: ?token=, an Authorization bearer header or the access_token cookie
+def websocket_token(websocket: WebSocket) -> Optional[str]:
+    authorization = websocket.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:]
+    return websocket.query_params.get("token") or websocket.cookies.get("access_token")
+
+@app.websocket("/ws/chatboxes/{chat_box_id}")
+async def chat_box_updates(websocket: WebSocket, chat_box_id: int):
+    token = websocket_token(websocket)
+    # Authenticate with a short-lived session so the socket does not pin a pooled connection
+    async with SessionLocal() as db:
+        try:
+            if token is None:
+                raise HTTPException(status_code=401, detail="Could not validate credentials")
+            current_user = await authenticate_token(token, db)
+            await crud.ensure_chatbox_access(db, user_id=current_user.id, chat_box_id=chat_box_id)
+        except (HTTPException, crud.ChatBoxAccessError) as e:
+            await websocket.close(code=4000 + e.status_code, reason=str(e.detail))
+            return
+    await websocket.accept()
+    async with message_broker.subscribe(chat_box_id) as queue:
+        # Incoming frames are ignored; the receiver only exists to notice the client going away
+        receiver = asyncio.create_task(websocket.receive())
+        getter = None
+        try:
+            while True:
+                if getter is None:
+                    getter = asyncio.create_task(queue.get())
+                done, _ = await asyncio.wait({getter, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    await websocket.send_text(getter.result().decode())
+                    getter = None
+                if receiver in done:
+                    if receiver.result()["type"] == "websocket.disconnect":
+                        break
+                    receiver = asyncio.create_task(websocket.receive())
+        except WebSocketDisconnect:
+            pass
+        finally:
+            receiver.cancel()
+            if getter is not None:
+                getter.cancel()
 
 @app.get("/auth/google")
 async def login_with_google(request: Request):
     redirect_uri = request.url_for('google_callback')
     session = request.session
-    print(session)  # Print session content for debugging
-    return await oauth.google.authorize_redirect(request, redirect_uri)
+    logger.debug("Session: %s", session)
+    return await get_google_client().authorize_redirect(request, redirect_uri)
 
 @app.get("/auth/google/callback")
-async def google_callback(request: Request, db: Session = Depends(get_db)):
+async def google_callback(request: Request, db: AsyncSession = Depends(get_db)):
     # Complete the OAuth flow
     session = request.session
-    print(session)  # Print session content for debugging
+    logger.debug("Session: %s", session)
+    google = get_google_client()
+    from authlib.integrations.starlette_client import OAuthError
     try:
-        token = await oauth.google.authorize_access_token(request)
+        token = await google.authorize_access_token(request)
     except OAuthError as e:
         return JSONResponse(content={"error": e.error, "error_description": e.description, "error_uri": e.uri})
     user_info = token["userinfo"]
 
-    user = crud.get_user_by_username(db, username=user_info['email'])
+    user = await crud.get_user_by_username(db, username=user_info['email'])
     if not user:
         user_in = schemas.UserCreate(username=user_info['email'], password='sub', email=user_info['email'], full_name=user_info['name'])
-        user = crud.create_user(db=db, user=user_in)
+        user = await crud.create_user(db=db, user=user_in)
 
     access_token = create_access_token(data={"sub": user.username, "id": user.id})
     response = JSONResponse(content={"access_token": access_token, "token_type": "bearer"})
@@ -193,6 +450,7 @@ def logout(request: Request):
     return response
 
 
+# Development server with auto-reload; production runs python -m app.server
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8888, reload=True)
\ No newline at end of file
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8888, reload=True)
\ No newline at end of file
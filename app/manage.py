@@ -0,0 +1,73 @@
+# app/manage.py
+"""Maintenance commands for the monthly chathistory partitions (Postgres only).
+
+    python -m app.manage list-partitions
+    python -m app.manage create-partitions --months-ahead 3
+    python -m app.manage archive-partitions --older-than-months 12 --archive-dir /var/lib/vfarm/archive
+
+Run create-partitions from cron well before the month turns: rows outside every monthly
+partition land in chathistory_default, and a month cannot be created while that holds rows for it.
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from datetime import date
+from app.archive import add_months, archive_partition, create_partitions, list_partitions, month_start, partition_range
+from app.config import ARCHIVE_AFTER_MONTHS, ARCHIVE_DIR, PARTITION_MONTHS_AHEAD
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+async def list_command(args) -> int:
+    async with engine.connect() as conn:
+        partitions = await list_partitions(conn)
+    for name, attached in partitions:
+        start, end = partition_range(name)
+        print(f"{name}  {start:%Y-%m-%d} .. {end:%Y-%m-%d}  {'attached' if attached else 'DETACHED (archive pending)'}")
+    return 0
+
+async def create_command(args) -> int:
+    async with engine.begin() as conn:
+        created = await create_partitions(conn, month_start(date.today()), args.months_ahead + 1)
+    for name in created:
+        logger.info("Created partition %s", name)
+    return 0
+
+async def archive_command(args) -> int:
+    cutoff = add_months(month_start(date.today()), -args.older_than_months)
+    async with engine.connect() as conn:
+        partitions = await list_partitions(conn)
+    for name, _ in partitions:
+        if partition_range(name)[1].date() > cutoff:
+            continue
+        if args.dry_run:
+            print(f"would archive {name}")
+            continue
+        archived = await archive_partition(engine, name, archive_dir=args.archive_dir)
+        logger.info("Archived %s: %d messages to %s", name, archived, args.archive_dir)
+    return 0
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m app.manage", description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list-partitions").set_defaults(handler=list_command)
+    create = commands.add_parser("create-partitions", help="Create the current and upcoming monthly partitions")
+    create.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    create.set_defaults(handler=create_command)
+    archive = commands.add_parser("archive-partitions", help="Detach old partitions and archive them to compressed files")
+    archive.add_argument("--older-than-months", type=int, default=ARCHIVE_AFTER_MONTHS)
+    archive.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    archive.add_argument("--dry-run", action="store_true")
+    archive.set_defaults(handler=archive_command)
+    return parser.parse_args(argv)
+
+async def main(args) -> int:
+    try:
+        return await args.handler(args)
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main(parse_args(sys.argv[1:]))))
@@ -0,0 +1,205 @@
+# app/metrics.py
+import bisect
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+# Default latency buckets in seconds, tuned around bcrypt and DB round-trip costs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class LatencyHistogram:
+    """Cumulative latency histogram that is safe to update from worker threads."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> float:
+        # Upper bound of the bucket holding the q-th observation
+        with self._lock:
+            target = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if count and seen >= target:
+                    return bound
+            return self.max
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "avg": round(self.sum / self.count, 6) if self.count else 0.0,
+            "max": round(self.max, 6),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+class RequestMetrics:
+    """Work attributed to the request currently being served."""
+    __slots__ = ("sql_count", "sql_time", "bcrypt_time", "serialization_time")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.bcrypt_time = 0.0
+        self.serialization_time = 0.0
+
+current_request_metrics: ContextVar[Optional[RequestMetrics]] = ContextVar("current_request_metrics", default=None)
+
+class MetricsRegistry:
+    """Per-route histograms and counters, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.request_latency: Dict[Tuple[str, str, str], LatencyHistogram] = defaultdict(LatencyHistogram)
+        self.sql_statements: Dict[Tuple[str, str], LatencyHistogram] = defaultdict(lambda: LatencyHistogram(buckets=STATEMENT_BUCKETS))
+        self.sql_time: Dict[Tuple[str, str], LatencyHistogram] = defaultdict(LatencyHistogram)
+        self.bcrypt_time: Dict[Tuple[str, str], float] = defaultdict(float)
+        self.serialization_time: Dict[Tuple[str, str], float] = defaultdict(float)
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float, request: RequestMetrics):
+        self.request_latency[(method, route, str(status))].observe(seconds)
+        self.sql_statements[(method, route)].observe(request.sql_count)
+        self.sql_time[(method, route)].observe(request.sql_time)
+        self.bcrypt_time[(method, route)] += request.bcrypt_time
+        self.serialization_time[(method, route)] += request.serialization_time
+
+    def render(self) -> str:
+        lines = []
+        lines += render_histograms("vfarm_http_request_duration_seconds", "HTTP request latency.",
+                                   ("method", "route", "status"), self.request_latency)
+        lines += render_histograms("vfarm_sql_statements_per_request", "SQL statements executed per request.",
+                                   ("method", "route"), self.sql_statements)
+        lines += render_histograms("vfarm_sql_duration_per_request_seconds", "Time spent in SQL per request.",
+                                   ("method", "route"), self.sql_time)
+        lines += render_counter("vfarm_bcrypt_duration_seconds_total", "Time requests spent waiting on bcrypt.",
+                                ("method", "route"), self.bcrypt_time)
+        lines += render_counter("vfarm_serialization_duration_seconds_total", "Time spent rendering response bodies.",
+                                ("method", "route"), self.serialization_time)
+        return "\n".join(lines) + "\n"
+
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 100)
+
+metrics_registry = MetricsRegistry()
+
+def record_sql(seconds: float):
+    request = current_request_metrics.get()
+    if request is not None:
+        request.sql_count += 1
+        request.sql_time += seconds
+
+def record_bcrypt(seconds: float):
+    request = current_request_metrics.get()
+    if request is not None:
+        request.bcrypt_time += seconds
+
+def record_serialization(seconds: float):
+    request = current_request_metrics.get()
+    if request is not None:
+        request.serialization_time += seconds
+
+def _labels(names: Sequence[str], values: Sequence) -> str:
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return ",".join(pairs)
+
+def render_histograms(name: str, help_text: str, label_names: Sequence[str], histograms: Dict[Tuple, LatencyHistogram]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for label_values, histogram in sorted(histograms.items()):
+        labels = _labels(label_names, label_values)
+        prefix = labels + "," if labels else ""
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+        lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+def render_counter(name: str, help_text: str, label_names: Sequence[str], values: Dict[Tuple, float]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    for label_values, value in sorted(values.items()):
+        lines.append(f"{name}{{{_labels(label_names, label_values)}}} {value}")
+    return lines
+
+def render_gauges(name: str, help_text: str, label_name: str, values: Dict[str, float]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for label_value, value in sorted(values.items()):
+        lines.append(f"{name}{{{_labels((label_name,), (label_value,))}}} {value}")
+    return lines
+
+class MetricsMiddleware:
+    """ASGI middleware timing each HTTP request and attributing SQL, bcrypt and serialization time to its route."""
+
+    def __init__(self, app, registry: MetricsRegistry = metrics_registry, profiler=None):
+        self.app = app
+        self.registry = registry
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request = RequestMetrics()
+        token = current_request_metrics.set(request)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile is not None:
+                    message.setdefault("headers", []).append((b"x-profile-output", profile.output_path.encode()))
+            await send(message)
+
+        profile = self.profiler.for_request(scope) if self.profiler is not None else None
+        start = time.perf_counter()
+        try:
+            if profile is not None:
+                with profile:
+                    await self.app(scope, receive, send_wrapper)
+            else:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request_metrics.reset(token)
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            self.registry.observe_request(scope["method"], route_path, status, elapsed, request)
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse that reports the time spent encoding its body to the request metrics."""
+
+    def render(self, content) -> bytes:
+        start = time.perf_counter()
+        body = super().render(content)
+        record_serialization(time.perf_counter() - start)
+        return body
+
+class TimedORJSONResponse(ORJSONResponse):
+    """ORJSONResponse that reports the time spent encoding its body to the request metrics."""
+
+    def render(self, content) -> bytes:
+        start = time.perf_counter()
+        body = super().render(content)
+        record_serialization(time.perf_counter() - start)
+        return body
@@ -1,11 +1,20 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, TIMESTAMP
+from sqlalchemy import DDL, Boolean, Column, Float, Index, Integer, String, ForeignKey, Text, TIMESTAMP, event
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from sqlalchemy.sql.functions import now
 from app.database import Base
 
+# SQLite compares timestamps as text, and CURRENT_TIMESTAMP ('YYYY-MM-DD HH:MM:SS') sorts before the same
+# second bound by SQLAlchemy ('... HH:MM:SS.000000'), which broke keyset cursors on equal timestamps.
+# now() therefore stores the bound format on SQLite, with millisecond precision.
+@compiles(now, 'sqlite')
+def _sqlite_now(element, compiler, **kw):
+    return "(strftime('%Y-%m-%d %H:%M:%f000', 'now'))"
+
 class User(Base):
     __tablename__ = 'users'
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     username = Column(String, unique=True, index=True, nullable=False)
     password_hash = Column(String, nullable=False)
     email = Column(String, unique=True, index=True)
@@ -14,20 +23,80 @@ class User(Base):
 
 class ChatBox(Base):
     __tablename__ = 'chatboxes'
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     name = Column(String, nullable=False)
     created_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    # Set by a soft delete; the history is purged in the background and the row removed last
+    deleted_at = Column(TIMESTAMP, nullable=True)
+    # Denormalized summary, kept current by every message insert so box lists need no history scan;
+    # last_activity_at is the creation time until the first message arrives
+    message_count = Column(Integer, nullable=False, default=0, server_default='0')
+    last_activity_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    last_message_preview = Column(String, nullable=True)
+    # End of the newest archived month of this box's history (app/archive.py); NULL while nothing is archived
+    archived_until = Column(TIMESTAMP, nullable=True)
     user = relationship("User", back_populates="chatboxes")
 
+    __table_args__ = (
+        Index('ix_chatboxes_user_id_id', 'user_id', 'id'),
+        Index('ix_chatboxes_user_id_last_activity_at', 'user_id', 'last_activity_at', 'id'),
+        Index('ix_chatboxes_deleted_at', 'deleted_at', postgresql_where=deleted_at.isnot(None)),
+    )
+
 class ChatHistory(Base):
     __tablename__ = 'chathistory'
-    id = Column(Integer, primary_key=True, index=True)
-    chat_box_id = Column(Integer, ForeignKey('chatboxes.id'), nullable=False)
+    id = Column(Integer, primary_key=True)
+    chat_box_id = Column(Integer, ForeignKey('chatboxes.id', ondelete='CASCADE'), nullable=False)
     message = Column(Text, nullable=False)
     sender = Column(String, nullable=False)
     timestamp = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+    # Position within the box, assigned from chatboxes.message_count under the box row lock, so it follows
+    # commit order; history deltas (since=) are read by it. NULL for messages written before it existed.
+    seq = Column(Integer, nullable=True)
     chat_box = relationship("ChatBox", back_populates="chathistory")
 
+    __table_args__ = (
+        Index('ix_chathistory_chat_box_id_timestamp_id', 'chat_box_id', 'timestamp', 'id'),
+        Index('ix_chathistory_chat_box_id_seq', 'chat_box_id', 'seq', postgresql_where=seq.isnot(None)),
+    )
+
+# On Postgres, chathistory is range-partitioned by month on timestamp (see the Alembic migrations and
+# app/manage.py); old partitions are exported per chat box to compressed files recorded here
+class ChatHistoryArchive(Base):
+    __tablename__ = 'chathistory_archives'
+    id = Column(Integer, primary_key=True)
+    chat_box_id = Column(Integer, nullable=False)
+    partition_name = Column(String, nullable=False)
+    path = Column(String, nullable=False)
+    range_start = Column(TIMESTAMP, nullable=False)
+    range_end = Column(TIMESTAMP, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    archived_at = Column(TIMESTAMP, server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        Index('ix_chathistory_archives_chat_box_id_range_start', 'chat_box_id', 'range_start'),
+    )
+
+# Token buckets shared by all workers when RATE_LIMIT_BACKEND=postgres (app/ratelimit.py); UNLOGGED on
+# Postgres, since losing them in a crash only resets the limits
+class RateLimitBucket(Base):
+    __tablename__ = 'rate_limit_buckets'
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    allowed = Column(Boolean, nullable=False)
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=func.now(), nullable=False)
+
+# Text search configuration behind chathistory.search_vector
+SEARCH_CONFIG = 'english'
+
+# Full-text search column and its GIN index exist on Postgres only (added by migration), so they are
+# created here for create_all setups instead of being mapped; SQLite searches an in-memory index
+for statement in (
+    f"ALTER TABLE chathistory ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (to_tsvector('{SEARCH_CONFIG}', message)) STORED",
+    "CREATE INDEX ix_chathistory_search_vector ON chathistory USING gin (search_vector)",
+):
+    event.listen(ChatHistory.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
 User.chatboxes = relationship("ChatBox", back_populates="user")
-ChatBox.chathistory = relationship("ChatHistory", back_populates="chat_box")
\ No newline at end of file
+ChatBox.chathistory = relationship("ChatHistory", back_populates="chat_box", passive_deletes=True)
\ No newline at end of file
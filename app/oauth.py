@@ -0,0 +1,45 @@
+# app/oauth.py
+import asyncio
+import logging
+import threading
+from app.config import GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, REDIRECT_URI, SECRET_KEY, OAUTH_METADATA_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+_oauth = None
+_lock = threading.Lock()
+
+# Registered on first use rather than at import: authlib pulls in httpx, a large share of a worker's cold start
+def get_google_client():
+    global _oauth
+    with _lock:
+        if _oauth is None:
+            from authlib.integrations.starlette_client import OAuth
+            oauth = OAuth()
+            oauth.register(
+                name='google',
+                server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
+                client_id=GOOGLE_CLIENT_ID,
+                client_secret=GOOGLE_CLIENT_SECRET,
+                authorize_params=None,
+                access_token_params=None,
+                redirect_uri=REDIRECT_URI,
+                client_kwargs={
+                    'scope': 'email profile openid',
+                    'redirect_url': REDIRECT_URI
+                },
+                authorize_state=SECRET_KEY
+            )
+            _oauth = oauth
+    return _oauth.google
+
+# Background warm-up started by the lifespan: import authlib off the event loop, then fetch Google's
+# discovery document; on failure the first login does both instead
+async def preload_google_client():
+    try:
+        client = await asyncio.to_thread(get_google_client)
+        await asyncio.wait_for(client.load_server_metadata(), OAUTH_METADATA_TIMEOUT)
+    except asyncio.CancelledError:
+        raise
+    except Exception as exc:
+        logger.warning("Could not preload Google OAuth metadata: %r", exc)
@@ -0,0 +1,69 @@
+# app/profiling.py
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+class SamplingProfile:
+    """Samples one thread's stack at a fixed interval and writes the result in collapsed-stack format.
+
+    The output (one "frame;frame;frame count" line per stack) feeds straight into flamegraph.pl,
+    speedscope or inferno. Requests run on the shared event loop thread, so samples taken while
+    another request holds the loop are attributed to this profile as well.
+    """
+
+    def __init__(self, output_path: str, interval: float):
+        self.output_path = output_path
+        self.interval = interval
+        self.samples = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def __enter__(self):
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._sampler.join()
+        self.write()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self):
+        os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
+        with open(self.output_path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+class RequestProfiler:
+    """Profiles a single request when it carries the X-Profile header (and the shared secret, if one is set)."""
+
+    HEADER = b"x-profile"
+
+    def __init__(self, output_dir: str, interval: float = 0.001, secret: Optional[str] = None):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.secret = secret
+
+    def for_request(self, scope) -> Optional[SamplingProfile]:
+        value = dict(scope.get("headers", ())).get(self.HEADER)
+        if value is None:
+            return None
+        if self.secret and value.decode() != self.secret:
+            return None
+        name = scope["path"].strip("/").replace("/", "_") or "root"
+        output_path = os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{scope['method']}-{name}-{time.monotonic_ns()}.folded")
+        return SamplingProfile(output_path, self.interval)
@@ -0,0 +1,62 @@
+# app/purger.py
+import asyncio
+import logging
+from typing import Optional
+from app import crud
+from app.config import PURGE_BATCH_SIZE, PURGE_BATCH_PAUSE, PURGE_INTERVAL
+from app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+class ChatBoxPurger:
+    """Background task deleting the history of soft-deleted chat boxes in short transactions."""
+
+    def __init__(self, batch_size: int = 1000, batch_pause: float = 0.05, interval: float = 30.0):
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.interval = interval
+        self.purged_rows = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    # Called after a soft delete so the purge starts without waiting for the next scan
+    def wake(self):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.purge()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Chat box purge failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def purge(self):
+        while True:
+            async with SessionLocal() as db:
+                removed = await crud.purge_deleted_chat_box_batch(db, batch_size=self.batch_size)
+            if removed is None:
+                return
+            self.purged_rows += removed
+            # Short pause between batches so regular writers are never queued behind the purge
+            await asyncio.sleep(self.batch_pause)
+
+chat_box_purger = ChatBoxPurger(batch_size=PURGE_BATCH_SIZE, batch_pause=PURGE_BATCH_PAUSE, interval=PURGE_INTERVAL)
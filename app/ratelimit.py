@@ -0,0 +1,225 @@
+# app/ratelimit.py
+import asyncio
+import logging
+import math
+import re
+import time
+from collections import OrderedDict, defaultdict
+from typing import Iterable, NamedTuple, Optional, Tuple
+from jose import JWTError
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from app.auth import decode_access_token
+from app.config import (
+    RATE_LIMIT_BACKEND, RATE_LIMIT_DEFAULT, RATE_LIMIT_MAX_KEYS, RATE_LIMIT_MESSAGES, RATE_LIMIT_SEARCH,
+    RATE_LIMIT_SIGNUP, RATE_LIMIT_TOKEN,
+)
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+class Budget(NamedTuple):
+    capacity: float
+    period: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.period
+
+# "capacity/seconds", e.g. "10/60" for bursts of 10 refilled at one every 6 seconds; "off" disables the rule
+def parse_budget(value: str) -> Optional[Budget]:
+    if value.strip().lower() in ("", "0", "off"):
+        return None
+    capacity, _, seconds = value.partition("/")
+    return Budget(float(capacity), float(seconds or 1))
+
+class Rule(NamedTuple):
+    name: str
+    methods: Optional[frozenset]  # None matches every method
+    path: re.Pattern
+    budget: Optional[Budget]
+    per_user: bool
+
+# Checked in order, first match wins; each request draws from exactly one bucket
+def default_rules():
+    return [
+        Rule("token", frozenset({"POST"}), re.compile(r"/token"), parse_budget(RATE_LIMIT_TOKEN), per_user=False),
+        Rule("signup", frozenset({"POST"}), re.compile(r"/users/"), parse_budget(RATE_LIMIT_SIGNUP), per_user=False),
+        Rule("messages", frozenset({"POST"}), re.compile(r"/chatboxes/(?:\d+/messages/|messages/bulk/)"),
+             parse_budget(RATE_LIMIT_MESSAGES), per_user=True),
+        Rule("search", frozenset({"GET"}), re.compile(r"/search/"), parse_budget(RATE_LIMIT_SEARCH), per_user=True),
+        Rule("default", None, re.compile(r"/.*"), parse_budget(RATE_LIMIT_DEFAULT), per_user=True),
+    ]
+
+class MemoryBucketStore:
+    """Token buckets of this process; the least recently used are dropped beyond max_keys."""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    # Returns whether the request may proceed and the tokens left in the bucket
+    async def take(self, key: str, budget: Budget, cost: float = 1.0) -> Tuple[bool, float]:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (budget.capacity, now))
+        tokens = min(budget.capacity, tokens + (now - updated_at) * budget.rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, tokens
+
+class PostgresBucketStore:
+    """Token buckets in the rate_limit_buckets table, shared by every worker; one upsert per request."""
+
+    # Refill and take in a single statement, so concurrent requests for a key serialize on its row
+    _REFILLED = ("least(CAST(:capacity AS float8), b.tokens + "
+                 "extract(epoch FROM now() - b.updated_at) * CAST(:rate AS float8))")
+    TAKE = text(
+        "INSERT INTO rate_limit_buckets AS b (key, tokens, allowed, updated_at) "
+        "VALUES (:key, CAST(:capacity AS float8) - CAST(:cost AS float8), true, now()) "
+        "ON CONFLICT (key) DO UPDATE SET "
+        f"tokens = {_REFILLED} - CASE WHEN {_REFILLED} >= CAST(:cost AS float8) THEN CAST(:cost AS float8) ELSE 0 END, "
+        f"allowed = {_REFILLED} >= CAST(:cost AS float8), "
+        "updated_at = now() "
+        "RETURNING allowed, tokens"
+    )
+    CLEANUP_INTERVAL = 300.0
+
+    def __init__(self, engine: AsyncEngine, max_period: float):
+        self.engine = engine
+        self.max_period = max_period
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._cleanup())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def take(self, key: str, budget: Budget, cost: float = 1.0) -> Tuple[bool, float]:
+        async with self.engine.begin() as conn:
+            result = await conn.execute(self.TAKE, {"key": key, "capacity": budget.capacity, "rate": budget.rate, "cost": cost})
+            allowed, tokens = result.one()
+        return allowed, tokens
+
+    # A bucket untouched for the longest refill period is full again, the same as no row at all
+    async def _cleanup(self):
+        while True:
+            await asyncio.sleep(self.CLEANUP_INTERVAL)
+            try:
+                async with self.engine.begin() as conn:
+                    await conn.execute(text(
+                        "DELETE FROM rate_limit_buckets WHERE updated_at < now() - make_interval(secs => :period)"
+                    ), {"period": self.max_period})
+            except Exception:
+                logger.exception("Rate limit bucket cleanup failed")
+
+class RateLimiter:
+    """Matches requests to per-route budgets and draws from the bucket of the user, or client IP."""
+
+    def __init__(self, store, rules: Iterable[Rule]):
+        self.store = store
+        self.rules = list(rules)
+        self.rejected = defaultdict(int)
+        self.errors = 0
+
+    async def start(self):
+        await self.store.start()
+
+    async def stop(self):
+        await self.store.stop()
+
+    def match(self, method: str, path: str) -> Optional[Rule]:
+        for rule in self.rules:
+            if (rule.methods is None or method in rule.methods) and rule.path.fullmatch(path):
+                return rule
+        return None
+
+    # The client address is the proxy's unless uvicorn runs with proxy headers (app.server does)
+    def identity(self, scope, rule: Rule) -> str:
+        if rule.per_user:
+            scheme, _, token = Headers(scope=scope).get("authorization", "").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                try:
+                    payload = decode_access_token(token)
+                    return f"user:{payload.get('id', payload.get('sub'))}"
+                except JWTError:
+                    pass  # rejected by the endpoint; counted against the client IP meanwhile
+        client = scope.get("client")
+        return f"ip:{client[0] if client else 'unknown'}"
+
+    # Seconds until the request would be allowed, or None when it may proceed now
+    async def check(self, scope) -> Optional[float]:
+        rule = self.match(scope["method"], scope["path"])
+        if rule is None or rule.budget is None:
+            return None
+        try:
+            allowed, tokens = await self.store.take(f"{rule.name}:{self.identity(scope, rule)}", rule.budget)
+        except Exception as exc:
+            # Fail open: a broken shared store must not take the API down with it
+            self.errors += 1
+            logger.warning("Rate limit store failed, allowing request: %r", exc)
+            return None
+        if allowed:
+            return None
+        self.rejected[rule.name] += 1
+        return (1.0 - tokens) / rule.budget.rate
+
+    def snapshot(self):
+        return {
+            "backend": type(self.store).__name__,
+            "rules": {rule.name: rule.budget._asdict() if rule.budget else None for rule in self.rules},
+            "rejected": dict(self.rejected),
+            "errors": self.errors,
+        }
+
+def create_store(backend: str):
+    if backend == "memory":
+        return MemoryBucketStore(max_keys=RATE_LIMIT_MAX_KEYS)
+    if backend == "postgres":
+        if engine.dialect.name != "postgresql":
+            raise ValueError("RATE_LIMIT_BACKEND=postgres needs a PostgreSQL DATABASE_URL")
+        return PostgresBucketStore(engine, max_period=max(rule.budget.period for rule in default_rules() if rule.budget))
+    raise ValueError(f"Unknown rate limit backend: {backend}")
+
+rate_limiter = RateLimiter(create_store(RATE_LIMIT_BACKEND), default_rules())
+
+class RateLimitMiddleware:
+    """Answers 429 with Retry-After once a client has spent its budget for the route."""
+
+    def __init__(self, app, limiter: RateLimiter = rate_limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        retry_after = await self.limiter.check(scope)
+        if retry_after is None:
+            await self.app(scope, receive, send)
+            return
+        response = JSONResponse(
+            status_code=429,
+            content={"message": "Too many requests"},
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+        await response(scope, receive, send)
@@ -34,10 +34,23 @@ class ChatBox(BaseModel):
     class Config:
         orm_mode = True
 
+class ChatBoxSummary(ChatBox):
+    message_count: int
+    last_activity_at: datetime
+    last_message_preview: Optional[str] = None
+
 class ChatMessageCreate(BaseModel):
     message: str
     sender: str
 
+class ChatMessageBulkCreate(ChatMessageCreate):
+    chat_box_id: int
+
+class ChatMessageBulkResult(BaseModel):
+    id: int
+    chat_box_id: int
+    timestamp: datetime
+
 class ChatMessage(BaseModel):
     id: int
     chat_box_id: int
@@ -48,5 +61,9 @@ class ChatMessage(BaseModel):
     class Config:
         orm_mode = True
 
+class ChatMessageSearchHit(ChatMessage):
+    rank: float
+    snippet: str
+
 class ChatBoxDeleteResponse(BaseModel):
     result: bool
\ No newline at end of file
@@ -0,0 +1,80 @@
+# app/search.py
+import asyncio
+import html
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import models
+
+WORD = re.compile(r"\w+")
+
+def tokenize(text: str) -> List[str]:
+    return WORD.findall(text.lower())
+
+# Highlight matched words like ts_headline's defaults: <b>..</b> around hits, a window of at most max_words
+def make_snippet(message: str, terms: Set[str], max_words: int = 35) -> str:
+    words = message.split()
+    first_hit = next((i for i, word in enumerate(words) if terms & set(tokenize(word))), 0)
+    start = max(0, min(first_hit - max_words // 3, len(words) - max_words))
+    snippet = []
+    for word in words[start:start + max_words]:
+        snippet.append(f"<b>{html.escape(word)}</b>" if terms & set(tokenize(word)) else html.escape(word))
+    return " ".join(snippet)
+
+class InMemorySearchIndex:
+    """Inverted index over chat messages for databases without full-text search (SQLite test setups).
+
+    Each search first indexes rows added since the previous one; rows of deleted chat boxes
+    are left in place and filtered out by the ownership check."""
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)  # term -> {message id: occurrences}
+        self._lengths: Dict[int, int] = {}
+        self._chat_boxes: Dict[int, int] = {}
+        self._last_id = 0
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add(self, message_id: int, chat_box_id: int, message: str):
+        tokens = tokenize(message)
+        for term, occurrences in Counter(tokens).items():
+            self._postings[term][message_id] = occurrences
+        self._lengths[message_id] = len(tokens)
+        self._chat_boxes[message_id] = chat_box_id
+        self._last_id = max(self._last_id, message_id)
+
+    def discard(self, message_ids: Iterable[int]):
+        for message_id in message_ids:
+            self._lengths.pop(message_id, None)
+            self._chat_boxes.pop(message_id, None)
+
+    async def refresh(self, db: AsyncSession):
+        async with self._lock:
+            result = await db.execute(
+                select(models.ChatHistory.id, models.ChatHistory.chat_box_id, models.ChatHistory.message)
+                .where(models.ChatHistory.id > self._last_id).order_by(models.ChatHistory.id)
+            )
+            for message_id, chat_box_id, message in result:
+                self.add(message_id, chat_box_id, message)
+
+    # Every term must match; ranked by matched occurrences, damped by message length
+    def search(self, terms: Set[str], chat_box_ids: Set[int]) -> List[Tuple[float, int]]:
+        if not terms:
+            return []
+        postings = [self._postings.get(term, {}) for term in terms]
+        candidates = set.intersection(*(set(posting) for posting in postings))
+        hits = []
+        for message_id in candidates:
+            if self._chat_boxes.get(message_id) not in chat_box_ids:
+                continue
+            occurrences = sum(posting[message_id] for posting in postings)
+            hits.append((occurrences / (1 + math.log(self._lengths[message_id])), message_id))
+        hits.sort(key=lambda hit: (-hit[0], -hit[1]))
+        return hits
+
+search_index = InMemorySearchIndex()
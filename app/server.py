@@ -0,0 +1,45 @@
+# app/server.py
+"""Production server: several uvicorn worker processes on uvloop and httptools.
+
+    python -m app.server
+    SERVER_WORKERS=4 SERVER_PORT=8000 python -m app.server
+
+Workers default to the CPU count. On SIGTERM or SIGINT each worker stops accepting connections, gives
+in-flight requests up to SERVER_GRACEFUL_TIMEOUT seconds to finish, then runs the lifespan shutdown,
+which closes the background tasks and disposes the engine.
+"""
+import importlib.util
+import logging
+import uvicorn
+from app.config import (
+    FORWARDED_ALLOW_IPS, MESSAGE_BROKER, SERVER_GRACEFUL_TIMEOUT, SERVER_HOST, SERVER_KEEPALIVE_TIMEOUT,
+    SERVER_PORT, SERVER_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+# The fast implementations when installed (they are in requirements.txt), else uvicorn's pure-Python ones
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    if SERVER_WORKERS > 1 and MESSAGE_BROKER == "memory":
+        logger.warning("MESSAGE_BROKER=memory with %d workers: websocket clients only see messages "
+                       "posted through their own worker; use MESSAGE_BROKER=postgres", SERVER_WORKERS)
+    uvicorn.run(
+        "app.main:app",
+        host=SERVER_HOST,
+        port=SERVER_PORT,
+        workers=SERVER_WORKERS,
+        loop="uvloop" if _installed("uvloop") else "asyncio",
+        http="httptools" if _installed("httptools") else "h11",
+        lifespan="on",
+        timeout_keep_alive=SERVER_KEEPALIVE_TIMEOUT,
+        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT,
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# app/writebehind.py
+import asyncio
+import logging
+from typing import List, NamedTuple, Optional
+from app import crud, schemas
+from app.config import WRITE_BEHIND_MAX_BATCH, WRITE_BEHIND_MAX_DELAY_MS, WRITE_BEHIND_MODE, WRITE_BEHIND_QUEUE_SIZE
+from app.database import SessionLocal, replica_router
+from app.metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindSaturated(Exception):
+    """Raised when the message queue is full, or closed for shutdown."""
+
+class PendingMessage(NamedTuple):
+    chat_box_id: int
+    user_id: int
+    message: schemas.ChatMessageCreate
+    future: Optional[asyncio.Future]  # None when nobody waits for the commit
+
+class WriteBehindBuffer:
+    """Bounded queue of new chat messages, inserted in group commits of up to max_batch rows.
+
+    A batch is flushed max_delay seconds after its first message arrives, or as soon as max_batch are
+    waiting. One flusher runs at a time, so messages keep their arrival order within each chat box.
+    """
+
+    def __init__(self, wait_for_commit: bool = True, max_batch: int = 500, max_delay: float = 0.005, queue_size: int = 10000):
+        self.wait_for_commit = wait_for_commit
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue_size = queue_size
+        self.flushed = 0
+        self.batches = 0
+        self.rejected = 0
+        self.failed = 0
+        self.flush_time = LatencyHistogram()
+        self._queue: Optional[asyncio.Queue] = None
+        self._batch_ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closed = True
+
+    async def start(self):
+        # Created here so they belong to the server's event loop
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._batch_ready = asyncio.Event()
+        self._closed = False
+        self._task = asyncio.create_task(self._run())
+
+    # Stops accepting messages and flushes everything already queued
+    async def stop(self):
+        if self._task is None:
+            return
+        self._closed = True
+        await self._queue.put(None)
+        self._batch_ready.set()
+        await self._task
+        self._task = None
+
+    # Queues a message whose chat box access was already checked. Returns a future resolving to the
+    # inserted row once its batch commits, or None in fire-and-forget mode.
+    def submit(self, chat_box_id: int, user_id: int, message: schemas.ChatMessageCreate) -> Optional[asyncio.Future]:
+        if self._closed:
+            raise WriteBehindSaturated("Message queue is shutting down")
+        future = asyncio.get_running_loop().create_future() if self.wait_for_commit else None
+        try:
+            self._queue.put_nowait(PendingMessage(chat_box_id, user_id, message, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise WriteBehindSaturated("Message queue is full")
+        if self._queue.qsize() >= self.max_batch:
+            self._batch_ready.set()
+        return future
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                return
+            if self._queue.qsize() + 1 < self.max_batch:
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), self.max_delay)
+                except asyncio.TimeoutError:
+                    pass
+            batch = [first]
+            stopping = False
+            while len(batch) < self.max_batch and not self._queue.empty():
+                entry = self._queue.get_nowait()
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+            await self._flush(batch)
+            if stopping:
+                # Nothing follows the marker: submit refuses new messages once the buffer is closed
+                return
+
+    async def _flush(self, batch: List[PendingMessage]):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            async with SessionLocal() as db:
+                outcomes = await crud.insert_chat_message_batch(db, [(entry.chat_box_id, entry.user_id, entry.message) for entry in batch])
+                await db.commit()
+        except Exception as exc:
+            self.failed += len(batch)
+            logger.exception("Write-behind flush of %d messages failed", len(batch))
+            for entry in batch:
+                if entry.future is not None and not entry.future.done():
+                    entry.future.set_exception(exc)
+            return
+        self.flush_time.observe(loop.time() - start)
+        self.batches += 1
+        # The flush session has no user of its own; each sender must read their message from the primary
+        for user_id in {entry.user_id for entry in batch}:
+            replica_router.record_write(user_id)
+        for entry, outcome in zip(batch, outcomes):
+            failed = isinstance(outcome, crud.ChatBoxAccessError)
+            if failed:
+                self.failed += 1
+            else:
+                self.flushed += 1
+            if entry.future is None:
+                if failed:
+                    logger.warning("Dropped queued message for chat box %s: %s", entry.chat_box_id, outcome.detail)
+            elif not entry.future.done():  # done already if the request was cancelled
+                if failed:
+                    entry.future.set_exception(outcome)
+                else:
+                    entry.future.set_result(outcome)
+
+    def snapshot(self):
+        return {
+            "mode": "commit" if self.wait_for_commit else "async",
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "queue_size": self.queue_size,
+            "max_batch": self.max_batch,
+            "max_delay": self.max_delay,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "flush_time": self.flush_time.snapshot(),
+        }
+
+def create_write_behind(mode: str) -> Optional[WriteBehindBuffer]:
+    if mode == "off":
+        return None
+    if mode not in ("commit", "async"):
+        raise ValueError(f"Unknown write-behind mode: {mode}")
+    return WriteBehindBuffer(wait_for_commit=mode == "commit", max_batch=WRITE_BEHIND_MAX_BATCH,
+                             max_delay=WRITE_BEHIND_MAX_DELAY_MS / 1000, queue_size=WRITE_BEHIND_QUEUE_SIZE)
+
+write_behind = create_write_behind(WRITE_BEHIND_MODE)
@@ -0,0 +1,121 @@
+"""Per-request cost of the ASGI middleware stack, measured by calling the app directly.
+
+Compares a bare app with the previous stack (CORS, SessionMiddleware on every request, metrics)
+and the current one (in-memory rate limiting, CORS, SessionMiddleware scoped to the OAuth routes,
+compression, metrics).
+Requests carry a signed session cookie, as browsers do once they have logged in with Google.
+
+    python -m benchmarks.bench_middleware
+    python -m benchmarks.bench_middleware --requests 20000 --payload-items 2000
+"""
+import argparse
+import asyncio
+import base64
+import json
+import sys
+import time
+
+from benchmarks.common import configure_environment
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000, help="Requests per stack and endpoint")
+    parser.add_argument("--payload-items", type=int, default=500, help="Messages in the large JSON response")
+    return parser.parse_args()
+
+def build_stacks(payload_items: int):
+    from fastapi import FastAPI
+    from fastapi.middleware.cors import CORSMiddleware
+    from starlette.middleware.sessions import SessionMiddleware
+    from app.config import BROTLI_QUALITY, COMPRESSION_MINIMUM_SIZE, GZIP_LEVEL, SECRET_KEY
+    from app.main import SESSION_PATHS, origins
+    from app.metrics import MetricsMiddleware, TimedORJSONResponse
+    from app.middleware import CompressionMiddleware, PathScopedMiddleware
+    from app.ratelimit import Budget, MemoryBucketStore, RateLimiter, RateLimitMiddleware, default_rules
+
+    large = [
+        {"id": i, "chat_box_id": 1, "message": f"message {i} " + "lorem ipsum " * 8, "sender": "user",
+         "timestamp": "2026-10-17T12:00:00.000000"}
+        for i in range(payload_items)
+    ]
+
+    def make_app(*middleware):
+        app = FastAPI()
+
+        @app.get("/small")
+        async def small():
+            return TimedORJSONResponse({"id": 1, "name": "box"})
+
+        @app.get("/large")
+        async def large_response():
+            return TimedORJSONResponse(large)
+
+        # Added innermost first, as in app.main
+        for middleware_class, options in middleware:
+            app.add_middleware(middleware_class, **options)
+        return app
+
+    cors = (CORSMiddleware, {"allow_origins": origins, "allow_credentials": True, "allow_methods": ["*"], "allow_headers": ["*"]})
+    metrics = (MetricsMiddleware, {})
+    # Budgets large enough that every request is allowed, so the cost measured is the bucket check
+    rules = [rule._replace(budget=Budget(1e12, 1)) for rule in default_rules()]
+    rate_limit = (RateLimitMiddleware, {"limiter": RateLimiter(MemoryBucketStore(), rules)})
+    return {
+        "bare": make_app(),
+        "previous": make_app(cors, (SessionMiddleware, {"secret_key": SECRET_KEY}), metrics),
+        "current": make_app(
+            rate_limit,
+            cors,
+            (PathScopedMiddleware, {"scoped_middleware": SessionMiddleware, "prefixes": SESSION_PATHS, "secret_key": SECRET_KEY}),
+            (CompressionMiddleware, {"minimum_size": COMPRESSION_MINIMUM_SIZE, "gzip_level": GZIP_LEVEL, "brotli_quality": BROTLI_QUALITY}),
+            metrics,
+        ),
+    }
+
+def session_cookie() -> bytes:
+    import itsdangerous
+    from app.config import SECRET_KEY
+    data = base64.b64encode(json.dumps({"user": {"email": "bench@example.com"}}).encode())
+    return b"session=" + itsdangerous.TimestampSigner(str(SECRET_KEY)).sign(data)
+
+async def call(app, path: str, headers) -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "root_path": "", "query_string": b"", "headers": headers,
+        "client": ("127.0.0.1", 50000), "server": ("bench", 80), "app": app,
+    }
+    size = 0
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal size
+        if message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return size
+
+async def main(args):
+    configure_environment()
+    stacks = build_stacks(args.payload_items)
+    headers = [(b"host", b"bench"), (b"accept-encoding", b"gzip, deflate, br"), (b"cookie", session_cookie())]
+    results = {}
+    for path in ("/small", "/large"):
+        for name, app in stacks.items():
+            for _ in range(200):
+                await call(app, path, headers)
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                size = await call(app, path, headers)
+            results[(path, name)] = ((time.perf_counter() - start) / args.requests * 1e6, size)
+
+    print(f"{'endpoint':<10}{'stack':<12}{'us/request':>14}{'overhead_us':>14}{'body_bytes':>14}")
+    for (path, name), (micros, size) in results.items():
+        overhead = micros - results[(path, "bare")][0]
+        print(f"{path:<10}{name:<12}{micros:>14.1f}{overhead:>14.1f}{size:>14}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,82 @@
+# benchmarks/common.py
+import json
+import os
+import statistics
+import tempfile
+from typing import Dict, List
+
+# Settings the app requires at import time; real values from the environment win
+BENCH_ENV = {
+    "DATABASE_URL": f"sqlite:///{os.path.join(tempfile.gettempdir(), 'vfarm_bench.db')}",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+    "SECRET_KEY": "benchmark-secret",
+    "GOOGLE_CLIENT_ID": "benchmark",
+    "GOOGLE_CLIENT_SECRET": "benchmark",
+    "REDIRECT_URI": "http://localhost:8888/auth/google/callback",
+    "RATE_LIMIT_ENABLED": "false",  # load tests would otherwise measure 429s
+}
+
+def configure_environment(database_url: str = None):
+    if database_url:
+        os.environ["DATABASE_URL"] = database_url
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0, queries: int = None) -> Dict:
+    count = len(latencies)
+    result = {
+        "requests": count,
+        "errors": errors,
+        "req_per_s": round(count / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+    if queries is not None:
+        result["queries_per_request"] = round(queries / count, 2) if count else 0.0
+    return result
+
+def print_table(results: Dict[str, Dict]):
+    columns = ["req_per_s", "p50_ms", "p95_ms", "p99_ms", "queries_per_request", "errors"]
+    columns = [column for column in columns if any(column in result for result in results.values())]
+    print(f"{'scenario':<22}" + "".join(f"{column:>21}" for column in columns))
+    for name, result in results.items():
+        print(f"{name:<22}" + "".join(f"{result.get(column, ''):>21}" for column in columns))
+
+# Throughput may not drop, and latency may not grow, by more than the tolerance; query counts may not grow
+def compare_with_baseline(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if "req_per_s" in reference and result["req_per_s"] < reference["req_per_s"] * (1 - tolerance):
+            regressions.append(f"{name}: req/s {result['req_per_s']} < baseline {reference['req_per_s']}")
+        for metric in ("p95_ms", "p99_ms"):
+            if metric in reference and result[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {result[metric]} > baseline {reference[metric]}")
+        # Background tasks add fractional noise; a real regression adds whole statements
+        if "queries_per_request" in reference and result.get("queries_per_request", 0) >= reference["queries_per_request"] + 0.5:
+            regressions.append(f"{name}: queries/request {result['queries_per_request']} > baseline {reference['queries_per_request']}")
+        if "total_ms" in reference and result["total_ms"] > reference["total_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: {result['total_ms']} ms > baseline {reference['total_ms']} ms")
+    return regressions
+
+def load_baseline(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_baseline(path: str, results: Dict):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
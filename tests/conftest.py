@@ -0,0 +1,43 @@
+# tests/conftest.py
+import asyncio
+import os
+import tempfile
+
+# app.config reads the environment at import time; always a throwaway SQLite file, never DATABASE_URL
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="vfarm-tests-"), "test.db")
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["READ_REPLICA_URLS"] = ""
+os.environ["MESSAGE_BROKER"] = "memory"
+os.environ["WRITE_BEHIND_MODE"] = "off"
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+
+import pytest
+from app import models
+from app.database import SessionLocal, engine
+
+async def _run_with_fresh_schema(scenario):
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.drop_all)
+            await conn.run_sync(models.Base.metadata.create_all)
+        async with SessionLocal() as db:
+            return await scenario(db)
+    finally:
+        # Pooled aiosqlite connections must not outlive the event loop of the test
+        await engine.dispose()
+
+# Runs an async scenario against an empty schema: run_db(scenario) where scenario(db) is a coroutine function
+@pytest.fixture
+def run_db():
+    return lambda scenario: asyncio.run(_run_with_fresh_schema(scenario))
+
+# A user owning one chat box; returns (user_id, chat_box_id)
+async def create_user_and_box(db, username: str = "alice"):
+    user = models.User(username=username, email=f"{username}@example.com", password_hash="-")
+    db.add(user)
+    await db.flush()
+    chat_box = models.ChatBox(name=f"{username}'s box", user_id=user.id)
+    db.add(chat_box)
+    await db.commit()
+    return user.id, chat_box.id
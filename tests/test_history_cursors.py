@@ -0,0 +1,56 @@
+# tests/test_history_cursors.py
+from sqlalchemy import func, select, update
+from app import crud, models, schemas
+from tests.conftest import create_user_and_box
+
+async def _messages_in_one_instant(db, count: int):
+    user_id, chat_box_id = await create_user_and_box(db)
+    for index in range(count):
+        await crud.create_chat_message(db, schemas.ChatMessageCreate(message=f"m{index}", sender="u"), chat_box_id, user_id)
+    # Every message shares the first one's stored timestamp, so only the id orders them
+    first = select(func.min(models.ChatHistory.timestamp)).scalar_subquery()
+    await db.execute(update(models.ChatHistory).values(timestamp=first))
+    await db.commit()
+    return user_id, chat_box_id
+
+def _ids(rows):
+    return [row.id for row in rows]
+
+def test_pages_forward_through_equal_timestamps(run_db):
+    async def scenario(db):
+        user_id, chat_box_id = await _messages_in_one_instant(db, 5)
+        pages = []
+        after = None
+        for _ in range(5):  # bounded, so a cursor that never advances fails instead of looping
+            page = await crud.get_chat_history(db, chat_box_id, user_id, limit=2, after=after)
+            if not page:
+                break
+            pages.append(_ids(page))
+            after = crud.encode_history_cursor(page[-1])
+        return pages
+
+    assert run_db(scenario) == [[1, 2], [3, 4], [5]]
+
+def test_pages_backward_through_equal_timestamps(run_db):
+    async def scenario(db):
+        user_id, chat_box_id = await _messages_in_one_instant(db, 5)
+        last = (await crud.get_chat_history(db, chat_box_id, user_id))[-1]
+        pages = []
+        before = crud.encode_history_cursor(last)
+        for _ in range(5):
+            page = await crud.get_chat_history(db, chat_box_id, user_id, limit=2, before=before)
+            if not page:
+                break
+            pages.append(_ids(page))
+            before = crud.encode_history_cursor(page[0])
+        return pages
+
+    assert run_db(scenario) == [[3, 4], [1, 2]]
+
+def test_stream_resumes_after_cursor_with_equal_timestamp(run_db):
+    async def scenario(db):
+        user_id, chat_box_id = await _messages_in_one_instant(db, 3)
+        second = (await crud.get_chat_history(db, chat_box_id, user_id, limit=2))[-1]
+        return [row.id async for row in crud.stream_chat_history(db, chat_box_id, user_id, after=crud.encode_history_cursor(second))]
+
+    assert run_db(scenario) == [3]
@@ -0,0 +1,36 @@
+# tests/test_replica_routing.py
+import orjson
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from app import crud, main, models, schemas
+from app.database import Replica, RoutingSession, engine, replica_router, routing_info
+from tests.conftest import create_user_and_box
+
+def test_streamed_history_reads_the_primary_after_a_write(run_db, monkeypatch, tmp_path):
+    # A replica with the schema but none of the rows: it lags behind every write
+    replica = Replica("sqlite:///" + str(tmp_path / "replica.db"))
+    replica.healthy = True
+    monkeypatch.setattr(replica_router, "replicas", [replica])
+    monkeypatch.setattr(main, "SessionLocal", async_sessionmaker(
+        engine, class_=AsyncSession, autoflush=False, expire_on_commit=False, sync_session_class=RoutingSession,
+    ))
+
+    async def scenario(db):
+        async with replica.engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+        try:
+            user_id, chat_box_id = await create_user_and_box(db)
+            await crud.create_chat_message(db, schemas.ChatMessageCreate(message="fresh", sender="u"), chat_box_id, user_id)
+            replica_router.record_write(user_id)
+            # As the request session of GET ?stream=true, after authentication
+            async with main.SessionLocal() as request_db:
+                request_db.info["user_id"] = user_id
+                chat_box = await crud.get_chat_box_version(request_db, chat_box_id, user_id)
+                routing = routing_info(request_db)
+            body = b"".join([chunk async for chunk in main.stream_chat_history_ndjson(
+                chat_box_id, user_id, None, None, None, chat_box.archived_until, routing,
+            )])
+        finally:
+            await replica.engine.dispose()
+        return chat_box.message_count, [orjson.loads(line)["message"] for line in body.splitlines()]
+
+    assert run_db(scenario) == (1, ["fresh"])